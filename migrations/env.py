@@ -51,6 +51,17 @@ def get_metadata():
     return target_db.metadata
 
 
+# FTS5 virtual tables (and their _data/_idx/_config/_docsize shadow tables) are
+# created by raw DDL in serenify.py, so autogenerate must not try to drop them
+FTS_TABLES = ('professional_fts', 'diary_fts')
+
+
+def include_name(name, type_, parent_names):
+    if type_ == 'table':
+        return not any(name == t or name.startswith(t + '_') for t in FTS_TABLES)
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +76,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_name=include_name
     )
 
     with context.begin_transaction():
@@ -93,6 +105,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_name", include_name)
 
     connectable = get_engine()
 
@@ -0,0 +1,48 @@
+"""Add full-text index over diary entries
+
+Revision ID: 0b7e4f29c5a1
+Revises: f3a8d1c7e264
+Create Date: 2026-10-16 14:58:41.207315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b7e4f29c5a1'
+down_revision = 'f3a8d1c7e264'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "CREATE VIRTUAL TABLE diary_fts USING fts5("
+        "content, user_id, content='diary_entry', content_rowid='id')"
+    )
+    op.execute("INSERT INTO diary_fts(diary_fts, rank) VALUES('rank', 'bm25(1.0, 0.0)')")
+    op.execute(
+        "CREATE TRIGGER diary_fts_ai AFTER INSERT ON diary_entry BEGIN "
+        "INSERT INTO diary_fts(rowid, content, user_id) VALUES (new.id, new.content, new.user_id); END"
+    )
+    op.execute(
+        "CREATE TRIGGER diary_fts_ad AFTER DELETE ON diary_entry BEGIN "
+        "INSERT INTO diary_fts(diary_fts, rowid, content, user_id) "
+        "VALUES ('delete', old.id, old.content, old.user_id); END"
+    )
+    op.execute(
+        "CREATE TRIGGER diary_fts_au AFTER UPDATE OF content, user_id ON diary_entry BEGIN "
+        "INSERT INTO diary_fts(diary_fts, rowid, content, user_id) "
+        "VALUES ('delete', old.id, old.content, old.user_id); "
+        "INSERT INTO diary_fts(rowid, content, user_id) VALUES (new.id, new.content, new.user_id); END"
+    )
+    # Index the entries that already exist
+    op.execute("INSERT INTO diary_fts(diary_fts) VALUES('rebuild')")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS diary_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS diary_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS diary_fts_ai")
+    op.execute("DROP TABLE IF EXISTS diary_fts")
@@ -0,0 +1,70 @@
+"""Add per-user yoga/meditation activity rollups
+
+Revision ID: 5d2c8e41f7b3
+Revises: 0b7e4f29c5a1
+Create Date: 2026-10-16 15:31:12.664018
+
+"""
+from datetime import date, timedelta
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2c8e41f7b3'
+down_revision = '0b7e4f29c5a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    rollup = op.create_table('activity_rollup',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('activity_type', sa.String(length=20), nullable=False),
+    sa.Column('total_sessions', sa.Integer(), nullable=False),
+    sa.Column('total_minutes', sa.Integer(), nullable=False),
+    sa.Column('completed_ids', sa.Text(), nullable=False),
+    sa.Column('current_streak', sa.Integer(), nullable=False),
+    sa.Column('longest_streak', sa.Integer(), nullable=False),
+    sa.Column('last_active_on', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'activity_type')
+    )
+
+    # Backfill from existing progress (same result as `flask rebuild-rollups`)
+    conn = op.get_bind()
+    rows = {}
+    for user_id, activity_type, sessions, minutes in conn.execute(sa.text(
+        "SELECT user_id, activity_type, count(*), coalesce(sum(duration_completed), 0) "
+        "FROM user_progress GROUP BY user_id, activity_type"
+    )):
+        rows[(user_id, activity_type)] = dict(
+            user_id=user_id, activity_type=activity_type,
+            total_sessions=sessions, total_minutes=minutes,
+            completed_ids=[], current_streak=0, longest_streak=0, last_active_on=None
+        )
+    for user_id, activity_type, activity_id in conn.execute(sa.text(
+        "SELECT DISTINCT user_id, activity_type, activity_id FROM user_progress ORDER BY activity_id"
+    )):
+        rows[(user_id, activity_type)]['completed_ids'].append(activity_id)
+    for user_id, activity_type, day in conn.execute(sa.text(
+        "SELECT DISTINCT user_id, activity_type, date(completed_at) AS day FROM user_progress "
+        "WHERE completed_at IS NOT NULL ORDER BY day"
+    )):
+        row = rows[(user_id, activity_type)]
+        day = date.fromisoformat(day)
+        previous = row['last_active_on']
+        row['current_streak'] = row['current_streak'] + 1 if previous == day - timedelta(days=1) else 1
+        row['longest_streak'] = max(row['longest_streak'], row['current_streak'])
+        row['last_active_on'] = day
+
+    for row in rows.values():
+        row['completed_ids'] = json.dumps(row['completed_ids'])
+    if rows:
+        op.bulk_insert(rollup, list(rows.values()))
+
+
+def downgrade():
+    op.drop_table('activity_rollup')
@@ -0,0 +1,28 @@
+"""Add shared cache generation counters
+
+Revision ID: 6a3f9c2d8b71
+Revises: b4e0a7d25c19
+Create Date: 2026-10-16 21:14:05.527391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a3f9c2d8b71'
+down_revision = 'b4e0a7d25c19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_version',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_version')
@@ -0,0 +1,54 @@
+"""Add hot path indexes
+
+Revision ID: 7c1e5a9d3f20
+Revises: 04009d44ea44
+Create Date: 2026-10-16 10:12:31.418204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e5a9d3f20'
+down_revision = '04009d44ea44'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.create_index('ix_appointment_professional_id_date_time_slot_status', ['professional_id', 'date', 'time_slot', 'status'], unique=False)
+        batch_op.create_index('ix_appointment_user_id', ['user_id'], unique=False)
+
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.create_index('ix_chat_message_appointment_id_id', ['appointment_id', 'id'], unique=False)
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_parent_id', ['parent_id'], unique=False)
+        batch_op.create_index('ix_comment_topic_created_at', ['topic', 'created_at'], unique=False)
+
+    with op.batch_alter_table('diary_entry', schema=None) as batch_op:
+        batch_op.create_index('ix_diary_entry_user_id_created_at', ['user_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('user_progress', schema=None) as batch_op:
+        batch_op.create_index('ix_user_progress_user_id_activity_type_activity_id', ['user_id', 'activity_type', 'activity_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user_progress', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_progress_user_id_activity_type_activity_id')
+
+    with op.batch_alter_table('diary_entry', schema=None) as batch_op:
+        batch_op.drop_index('ix_diary_entry_user_id_created_at')
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_topic_created_at')
+        batch_op.drop_index('ix_comment_parent_id')
+
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_message_appointment_id_id')
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointment_user_id')
+        batch_op.drop_index('ix_appointment_professional_id_date_time_slot_status')
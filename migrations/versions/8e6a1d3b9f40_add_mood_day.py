@@ -0,0 +1,68 @@
+"""Add daily mood rollup
+
+Revision ID: 8e6a1d3b9f40
+Revises: 5d2c8e41f7b3
+Create Date: 2026-10-16 16:07:53.918472
+
+Existing entries are backfilled here, using a copy of the app's emoji -> mood
+table as it stood at this revision (same result as `flask rebuild-moods`).
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e6a1d3b9f40'
+down_revision = '5d2c8e41f7b3'
+branch_labels = None
+depends_on = None
+
+# (category, valence) -> emojis; any other emoji from the picker is neutral
+MOOD_GROUPS = {
+    ("joyful", 2): "😃 😄 😁 😆 😂 🤣 🥹 ☺️ 😊 😇 😍 🥰 🤩 🥳",
+    ("content", 1): "😅 🥲 🙂 🙃 😉 😌 😘 😗 😙 😚 😋 😛 😝 😜 🤪 🤓 😎 🥸 🙂‍↕️ 😏 🤗 🫡 🤭 🤑 🤠",
+    ("tired", -1): "😮‍💨 🥱 😴 🫩 🤤 😪 🫠 🫥",
+    ("unwell", -1): "😵 😵‍💫 🥴 🤢 🤮 🤧 😷 🤒 🤕 🥵 🥶",
+    ("sad", -2): "😞 😔 😟 😕 🙁 ☹️ 😣 😖 😫 😩 🥺 😢 😭 😥 😓",
+    ("angry", -2): "😒 😤 😠 😡 🤬 🙄",
+    ("anxious", -2): "🤯 😳 😱 😨 😰 🫣 😬 🫨",
+    ("neutral", 0): "🤨 🧐 🙂‍↔️ 🤔 🫢 🤫 🤥 😶 😶‍🌫️ 😐 😑 😯 😦 😧 😮 😲 🤐",
+}
+
+
+def upgrade():
+    mood_day = op.create_table('mood_day',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('category', sa.String(length=20), nullable=False),
+    sa.Column('entries', sa.Integer(), nullable=False),
+    sa.Column('valence_sum', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'day', 'category')
+    )
+
+    # Backfill: the diary is grouped per (user, day, emoji) in SQL, then folded into moods
+    moods = {emoji: mood for mood, members in MOOD_GROUPS.items() for emoji in members.split()}
+    conn = op.get_bind()
+    rows = {}
+    for user_id, day, emoji, entries in conn.execute(sa.text(
+        "SELECT user_id, date(created_at) AS day, emoji, count(*) FROM diary_entry "
+        "WHERE created_at IS NOT NULL AND emoji IS NOT NULL GROUP BY user_id, day, emoji"
+    )):
+        if emoji not in moods:
+            continue
+        category, valence = moods[emoji]
+        key = (user_id, day, category)
+        row = rows.setdefault(key, dict(user_id=user_id, day=date.fromisoformat(day),
+                                        category=category, entries=0, valence_sum=0))
+        row['entries'] += entries
+        row['valence_sum'] += valence * entries
+    if rows:
+        op.bulk_insert(mood_day, list(rows.values()))
+
+
+def downgrade():
+    op.drop_table('mood_day')
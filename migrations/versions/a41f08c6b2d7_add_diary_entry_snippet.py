@@ -0,0 +1,32 @@
+"""Add diary entry snippet
+
+Revision ID: a41f08c6b2d7
+Revises: 7c1e5a9d3f20
+Create Date: 2026-10-16 11:03:52.770114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f08c6b2d7'
+down_revision = '7c1e5a9d3f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('diary_entry', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('snippet', sa.String(length=210), nullable=True))
+
+    # Backfill previews for existing entries (same rule as DiaryEntry.set_content)
+    op.execute(
+        "UPDATE diary_entry SET snippet = CASE WHEN length(content) > 200 "
+        "THEN substr(content, 1, 200) || '…' ELSE content END"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('diary_entry', schema=None) as batch_op:
+        batch_op.drop_column('snippet')
@@ -0,0 +1,44 @@
+"""Add quiz results and score histogram
+
+Revision ID: b4e0a7d25c19
+Revises: 2f9b7c6e1a58
+Create Date: 2026-10-16 17:26:35.180247
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e0a7d25c19'
+down_revision = '2f9b7c6e1a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('quiz_result',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('answers', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('quiz_result', schema=None) as batch_op:
+        batch_op.create_index('ix_quiz_result_user_id_created_at', ['user_id', 'created_at'], unique=False)
+
+    op.create_table('quiz_score_count',
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('results', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('total')
+    )
+
+
+def downgrade():
+    op.drop_table('quiz_score_count')
+    with op.batch_alter_table('quiz_result', schema=None) as batch_op:
+        batch_op.drop_index('ix_quiz_result_user_id_created_at')
+
+    op.drop_table('quiz_result')
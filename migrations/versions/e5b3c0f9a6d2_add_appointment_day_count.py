@@ -0,0 +1,54 @@
+"""Add appointment day counters and active slot uniqueness
+
+Revision ID: e5b3c0f9a6d2
+Revises: c9e27d4a1b85
+Create Date: 2026-10-16 13:41:26.105937
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b3c0f9a6d2'
+down_revision = 'c9e27d4a1b85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('appointment_day_count',
+    sa.Column('professional_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('booked', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['professional_id'], ['professional.id'], ),
+    sa.PrimaryKeyConstraint('professional_id', 'date')
+    )
+
+    # Double bookings made before this migration: keep the earliest request for
+    # each slot and decline the rest so the unique index can be built.
+    op.execute("""
+        UPDATE appointment SET status = 'declined'
+        WHERE status IN ('pending', 'accepted')
+          AND id NOT IN (
+            SELECT MIN(id) FROM appointment
+            WHERE status IN ('pending', 'accepted')
+            GROUP BY professional_id, date, time_slot
+          )
+    """)
+    op.execute("""
+        INSERT INTO appointment_day_count (professional_id, date, booked)
+        SELECT professional_id, date, COUNT(*) FROM appointment
+        WHERE status IN ('pending', 'accepted')
+        GROUP BY professional_id, date
+    """)
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.create_index('uq_appointment_active_slot', ['professional_id', 'date', 'time_slot'], unique=True, sqlite_where=sa.text("status IN ('pending', 'accepted')"))
+
+
+def downgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index('uq_appointment_active_slot')
+
+    op.drop_table('appointment_day_count')
@@ -0,0 +1,49 @@
+"""Add full-text index over the professional directory
+
+Revision ID: f3a8d1c7e264
+Revises: e5b3c0f9a6d2
+Create Date: 2026-10-16 14:22:08.413920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8d1c7e264'
+down_revision = 'e5b3c0f9a6d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "CREATE VIRTUAL TABLE professional_fts USING fts5("
+        "full_name, profession, bio, content='professional', content_rowid='id')"
+    )
+    op.execute(
+        "CREATE TRIGGER professional_fts_ai AFTER INSERT ON professional BEGIN "
+        "INSERT INTO professional_fts(rowid, full_name, profession, bio) "
+        "VALUES (new.id, new.full_name, new.profession, new.bio); END"
+    )
+    op.execute(
+        "CREATE TRIGGER professional_fts_ad AFTER DELETE ON professional BEGIN "
+        "INSERT INTO professional_fts(professional_fts, rowid, full_name, profession, bio) "
+        "VALUES ('delete', old.id, old.full_name, old.profession, old.bio); END"
+    )
+    op.execute(
+        "CREATE TRIGGER professional_fts_au AFTER UPDATE ON professional BEGIN "
+        "INSERT INTO professional_fts(professional_fts, rowid, full_name, profession, bio) "
+        "VALUES ('delete', old.id, old.full_name, old.profession, old.bio); "
+        "INSERT INTO professional_fts(rowid, full_name, profession, bio) "
+        "VALUES (new.id, new.full_name, new.profession, new.bio); END"
+    )
+    # Index the professionals that already exist
+    op.execute("INSERT INTO professional_fts(professional_fts) VALUES('rebuild')")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS professional_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS professional_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS professional_fts_ai")
+    op.execute("DROP TABLE IF EXISTS professional_fts")
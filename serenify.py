@@ -1,39 +1,148 @@
 from datetime import datetime
 from datetime import date
+from datetime import timedelta
 import os
-from flask import Flask, get_flashed_messages, render_template, request, redirect, session, url_for,flash
+import re
+import json
+import csv
+import gzip
+import io
+import itertools
+import zlib
+import math
+import random
+import hashlib
+import shutil
+import struct
+import subprocess
+import tempfile
+import queue
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from functools import wraps
+from flask import Flask, get_flashed_messages, render_template, request, redirect, session, url_for,flash, jsonify, Response, g, send_file, stream_with_context
+from markupsafe import Markup, escape
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from sqlalchemy.orm import joinedload, load_only
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import event, DDL
+from sqlalchemy.engine import Engine
 from flask_migrate import Migrate
 from dotenv import load_dotenv
+import click
 import google.generativeai as genai
+from google.generativeai.types import content_types
+from fuzzywuzzy import fuzz, process
 
 
 # --- Flask App Configuration ---
+load_dotenv()
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'paramjeet'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", 'sqlite:///users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# Optional read replica, e.g. sqlite:///replica.db locally (see `flask sync-replica`)
+if os.getenv("READ_REPLICA_URL"):
+    app.config['SQLALCHEMY_BINDS'] = {'replica': os.getenv("READ_REPLICA_URL")}
+# Whole-request cap; per-kind limits are in MEDIA_LIMITS
+app.config['MAX_CONTENT_LENGTH'] = 220 * 1024 * 1024
+app.config['MEDIA_ROOT'] = os.path.join(app.instance_path, 'media')
+# Behind nginx: an internal location aliased to MEDIA_ROOT, e.g. /_media/
+app.config['MEDIA_ACCEL_PREFIX'] = os.getenv("MEDIA_ACCEL_PREFIX")
+
+# --- Database Engine ---
+# Applied to every new SQLite connection. WAL lets readers carry on while one
+# writer commits, and busy_timeout makes writers queue instead of failing.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,  # KiB, i.e. 64 MB
+}
+
+@event.listens_for(Engine, "connect")
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not type(dbapi_connection).__module__.startswith("sqlite3"):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """Sends reads to the replica inside views marked @read_replica, everything else to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not getattr(clause, 'is_dml', False)
+                and g and g.get('use_replica') and 'replica' in self._db.engines):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 migrate = Migrate(app, db)
-load_dotenv()
+
+def read_replica(view):
+    """Serve a view's GET requests from the read replica, when one is configured.
+
+    Replicas lag, so only use it on pages where a few seconds' staleness is fine.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        g.use_replica = request.method == 'GET'
+        return view(*args, **kwargs)
+    return wrapped
+
 app.secret_key = os.getenv("SECRET_KEY", "your_fallback_secret")
 
 # --- Database Models ---
+DIARY_SNIPPET_LENGTH = 200
+
 class DiaryEntry(db.Model):
+    __table_args__ = (
+        # home() / past_entries(): one user's entries, newest first
+        db.Index('ix_diary_entry_user_id_created_at', 'user_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
+    # Short preview kept alongside content so list pages never load the full text
+    snippet = db.Column(db.String(210), nullable=True)
     emoji = db.Column(db.String(10), nullable=True)
     created_at = db.Column(db.DateTime, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    def set_content(self, content):
+        self.content = content
+        self.snippet = content[:DIARY_SNIPPET_LENGTH] + ("…" if len(content) > DIARY_SNIPPET_LENGTH else "")
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+class MoodDay(db.Model):
+    # Diary moods per user, day and category, kept in step with DiaryEntry by record_mood()
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(20), primary_key=True)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+    valence_sum = db.Column(db.Integer, nullable=False, default=0)
+
 class ChatMessage(db.Model):
+    __table_args__ = (
+        # session_chat(): cursor reads by id within one appointment
+        db.Index('ix_chat_message_appointment_id_id', 'appointment_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -56,7 +165,70 @@ class Professional(db.Model):
     # Corrected the backref to avoid confusion
     appointments = db.relationship('Appointment', backref='professional_rel', lazy=True)
 
+# Full-text index over the directory fields, kept in sync by triggers.
+# Declared outside db.metadata so create_all doesn't try to build it as a plain table.
+fts_metadata = db.MetaData()
+professional_fts = db.Table(
+    'professional_fts', fts_metadata,
+    db.Column('rowid', db.Integer),
+    db.Column('rank', db.Float),
+)
+
+PROFESSIONAL_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS professional_fts USING fts5("
+    "full_name, profession, bio, content='professional', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS professional_fts_ai AFTER INSERT ON professional BEGIN "
+    "INSERT INTO professional_fts(rowid, full_name, profession, bio) "
+    "VALUES (new.id, new.full_name, new.profession, new.bio); END",
+    "CREATE TRIGGER IF NOT EXISTS professional_fts_ad AFTER DELETE ON professional BEGIN "
+    "INSERT INTO professional_fts(professional_fts, rowid, full_name, profession, bio) "
+    "VALUES ('delete', old.id, old.full_name, old.profession, old.bio); END",
+    "CREATE TRIGGER IF NOT EXISTS professional_fts_au AFTER UPDATE ON professional BEGIN "
+    "INSERT INTO professional_fts(professional_fts, rowid, full_name, profession, bio) "
+    "VALUES ('delete', old.id, old.full_name, old.profession, old.bio); "
+    "INSERT INTO professional_fts(rowid, full_name, profession, bio) "
+    "VALUES (new.id, new.full_name, new.profession, new.bio); END",
+]
+for statement in PROFESSIONAL_FTS_DDL:
+    event.listen(Professional.__table__, 'after_create', DDL(statement))
+
+# Diary search index. user_id is indexed as a token so a search only walks the
+# posting lists of the searching user's entries, not every journal on the site.
+diary_fts = db.Table(
+    'diary_fts', fts_metadata,
+    db.Column('rowid', db.Integer),
+    db.Column('rank', db.Float),
+)
+
+DIARY_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS diary_fts USING fts5("
+    "content, user_id, content='diary_entry', content_rowid='id')",
+    # bm25 over the text only; the owner column is for filtering
+    "INSERT INTO diary_fts(diary_fts, rank) VALUES('rank', 'bm25(1.0, 0.0)')",
+    "CREATE TRIGGER IF NOT EXISTS diary_fts_ai AFTER INSERT ON diary_entry BEGIN "
+    "INSERT INTO diary_fts(rowid, content, user_id) VALUES (new.id, new.content, new.user_id); END",
+    "CREATE TRIGGER IF NOT EXISTS diary_fts_ad AFTER DELETE ON diary_entry BEGIN "
+    "INSERT INTO diary_fts(diary_fts, rowid, content, user_id) "
+    "VALUES ('delete', old.id, old.content, old.user_id); END",
+    "CREATE TRIGGER IF NOT EXISTS diary_fts_au AFTER UPDATE OF content, user_id ON diary_entry BEGIN "
+    "INSERT INTO diary_fts(diary_fts, rowid, content, user_id) "
+    "VALUES ('delete', old.id, old.content, old.user_id); "
+    "INSERT INTO diary_fts(rowid, content, user_id) VALUES (new.id, new.content, new.user_id); END",
+]
+for statement in DIARY_FTS_DDL:
+    event.listen(DiaryEntry.__table__, 'after_create', DDL(statement))
+
 class Appointment(db.Model):
+    __table_args__ = (
+        # appointment() slot checks and the professional dashboard
+        db.Index('ix_appointment_professional_id_date_time_slot_status',
+                 'professional_id', 'date', 'time_slot', 'status'),
+        # professional_support(): a user's own bookings
+        db.Index('ix_appointment_user_id', 'user_id'),
+        # One active (pending/accepted) booking per professional, day and slot
+        db.Index('uq_appointment_active_slot', 'professional_id', 'date', 'time_slot',
+                 unique=True, sqlite_where=db.text("status IN ('pending', 'accepted')")),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -75,9 +247,20 @@ class Appointment(db.Model):
         default="pending"   # IMPORTANT
     )
 
+class AppointmentDayCount(db.Model):
+    # Active bookings per professional per day, kept in step with Appointment by book_appointment()
+    professional_id = db.Column(db.Integer, db.ForeignKey('professional.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    booked = db.Column(db.Integer, nullable=False, default=0)
 
 
 class Comment(db.Model):
+    __table_args__ = (
+        # distress_page(): a topic's comments, newest first
+        db.Index('ix_comment_topic_created_at', 'topic', 'created_at'),
+        # comment.replies
+        db.Index('ix_comment_parent_id', 'parent_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     topic = db.Column(db.String(50), nullable=False)
     text = db.Column(db.String(500), nullable=False)
@@ -103,10 +286,13 @@ class User(db.Model):
     role = db.Column(db.String(20), default='user')  # user / professional
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return self.password_hash.split("$", 1)[0] != PASSWORD_METHOD
     
 
 class YogaPose(db.Model):
@@ -124,6 +310,16 @@ class YogaPose(db.Model):
     
     creator = db.relationship('User', backref='yoga_poses')
 
+class MediaBlob(db.Model):
+    # One stored file per distinct content (sha256), shared by every upload of it
+    sha256 = db.Column(db.String(64), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # image, video or certificate
+    size = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, ready, rejected
+    duration_seconds = db.Column(db.Float, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
 class MeditationSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
@@ -138,6 +334,11 @@ class MeditationSession(db.Model):
     creator = db.relationship('User', backref='meditation_sessions')
 
 class UserProgress(db.Model):
+    __table_args__ = (
+        # yoga/meditation pages and yoga_detail(): a user's progress per activity
+        db.Index('ix_user_progress_user_id_activity_type_activity_id',
+                 'user_id', 'activity_type', 'activity_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     activity_type = db.Column(db.String(20), nullable=False)  # yoga or meditation
@@ -146,25 +347,317 @@ class UserProgress(db.Model):
     duration_completed = db.Column(db.Integer, nullable=False)
     notes = db.Column(db.Text, nullable=True)
 
+class ActivityRollup(db.Model):
+    # Per-user totals for one activity type, kept in step with UserProgress by record_activity()
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    activity_type = db.Column(db.String(20), primary_key=True)
+    total_sessions = db.Column(db.Integer, nullable=False, default=0)
+    total_minutes = db.Column(db.Integer, nullable=False, default=0)
+    completed_ids = db.Column(db.Text, nullable=False, default='[]')  # JSON list, distinct and sorted
+    current_streak = db.Column(db.Integer, nullable=False, default=0)
+    longest_streak = db.Column(db.Integer, nullable=False, default=0)
+    last_active_on = db.Column(db.Date, nullable=True)
+
+    def completed_id_list(self):
+        return json.loads(self.completed_ids or '[]')
+
+    def streak_as_of(self, day):
+        # A streak survives until the end of the day after its last session
+        if self.last_active_on and self.last_active_on >= day - timedelta(days=1):
+            return self.current_streak
+        return 0
+
+class QuizResult(db.Model):
+    __table_args__ = (
+        # health_quiz(): a user's latest results
+        db.Index('ix_quiz_result_user_id_created_at', 'user_id', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    total = db.Column(db.Integer, nullable=False)
+    # One byte per question (0-3), in QUESTIONS order
+    answers = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def answer_list(self):
+        return list(array('B', self.answers))
+
+class QuizScoreCount(db.Model):
+    # Population histogram: how many stored results have each possible total
+    total = db.Column(db.Integer, primary_key=True)
+    results = db.Column(db.Integer, nullable=False, default=0)
+
+class Conversation(db.Model):
+    # Chatbot conversation; the session cookie only carries its id
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    # Rolling model-written summary of turns that fell out of the context window
+    summary = db.Column(db.Text, nullable=True)
+    summarized_through = db.Column(db.Integer, default=0)  # last ConversationTurn.id in summary
+
+class ConversationTurn(db.Model):
+    __table_args__ = (
+        # Recent turns of one conversation, newest first
+        db.Index('ix_conversation_turn_conversation_id_id', 'conversation_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    speaker = db.Column(db.String(4), nullable=False)  # user / bot
+    text = db.Column(db.Text, nullable=False)
+
+class CacheVersion(db.Model):
+    # Generation counters for VersionedCache, shared by every worker process.
+    # Bumped in the same transaction as the write that makes cached copies stale.
+    name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# --- Password Hashing ---
+# scrypt is deliberately CPU-heavy, so it runs in worker processes instead of on the
+# request thread. Hashes made with other parameters are upgraded at the next login.
+PASSWORD_METHOD = "scrypt:32768:8:1"
+PASSWORD_WORKERS = os.cpu_count() or 2
+# Hash/verify jobs allowed in flight or queued; beyond this logins are turned away
+PASSWORD_MAX_PENDING = PASSWORD_WORKERS * 4
+PASSWORD_TIMEOUT_SECONDS = 10
+
+class PasswordBusy(Exception):
+    """Too many password jobs queued, or one missed its deadline."""
+
+password_slots = threading.BoundedSemaphore(PASSWORD_MAX_PENDING)
+password_pool = None
+password_pool_lock = threading.Lock()
+
+def get_password_pool():
+    # Created on first use so each gunicorn worker gets its own; spawn because
+    # forking a process that already runs threads isn't safe
+    global password_pool
+    with password_pool_lock:
+        if password_pool is None:
+            password_pool = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return password_pool
+
+def reset_password_pool(broken):
+    # A worker died (OOM kill, segfault) and the executor refuses all new work;
+    # drop it so the next job starts a fresh pool
+    global password_pool
+    with password_pool_lock:
+        if password_pool is broken:
+            password_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+def run_password_job(fn, *args):
+    if not password_slots.acquire(blocking=False):
+        raise PasswordBusy("password pool full")
+    try:
+        pool = get_password_pool()
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        password_slots.release()
+        reset_password_pool(pool)
+        raise PasswordBusy("password pool crashed")
+    except Exception:
+        password_slots.release()
+        raise
+    future.add_done_callback(lambda f: password_slots.release())
+    try:
+        return future.result(timeout=PASSWORD_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        raise PasswordBusy("password job timed out")
+    except BrokenProcessPool:
+        reset_password_pool(pool)
+        raise PasswordBusy("password pool crashed")
+
+def hash_password(password):
+    return run_password_job(generate_password_hash, password, PASSWORD_METHOD)
+
+def verify_password(password_hash, password):
+    return run_password_job(check_password_hash, password_hash, password)
+
+# --- Current User ---
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL_SECONDS = 300
+
+# Plain read-only copy of the columns routes and templates use, safe to share between requests
+CachedUser = namedtuple('CachedUser', ['id', 'username', 'name', 'email', 'role'])
+
+class TTLCache:
+    """Bounded LRU where each entry is kept for at most ttl seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+class UserCache(TTLCache):
+    """CachedUser records by user id."""
+
+    def put(self, user):
+        record = CachedUser(user.id, user.username, user.name, user.email, user.role)
+        return self.set(user.id, record)
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+class VersionedCache(TTLCache):
+    """Shared listings keyed by (kind, generation, filters).
+
+    A write to a kind bumps its generation and drops its listings, so a
+    listing loaded while the write was happening is stored under a stale
+    key and never served.
+
+    Generations live in the cache_version table under "<namespace>:<kind>",
+    so every worker sees a bump as soon as it is committed; call
+    invalidate_kind() before the write's commit.
+    """
+
+    def __init__(self, maxsize, ttl, namespace):
+        super().__init__(maxsize, ttl)
+        self.namespace = namespace
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def generation(self, kind):
+        # One primary-key read; it happens in the same transaction as load()
+        return db.session.query(CacheVersion.version) \
+            .filter_by(name=f"{self.namespace}:{kind}").scalar() or 0
+
+    def listing(self, kind, filters, load):
+        key = (kind, self.generation(kind), filters)
+        rows = self.get(key)
+        with self.lock:
+            self.stats['hits' if rows is not None else 'misses'] += 1
+        if rows is None:
+            rows = self.set(key, load())
+        return rows
+
+    def invalidate_kind(self, kind):
+        db.session.execute(sqlite_insert(CacheVersion).values(
+            name=f"{self.namespace}:{kind}", version=1
+        ).on_conflict_do_update(
+            index_elements=[CacheVersion.name],
+            set_={'version': CacheVersion.version + 1}
+        ))
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == kind]:
+                del self.entries[key]
+            self.stats['invalidations'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+def remember_login(user):
+    session["username"] = user.username
+    session["user_id"] = user.id
+    user_cache.put(user)
+
+def forget_login():
+    user_id = session.pop('user_id', None)
+    session.pop('username', None)
+    if user_id is not None:
+        user_cache.invalidate(user_id)
+
+@app.before_request
+def load_current_user():
+    g.user = None
+    user_id = session.get('user_id')
+    if user_id is None:
+        if 'username' not in session:
+            return
+        # Sessions from before user_id was stored: resolve once, then upgrade the cookie
+        user = User.query.filter_by(username=session['username']).first()
+        if user:
+            session['user_id'] = user.id
+            g.user = user_cache.put(user)
+        return
+
+    g.user = user_cache.get(user_id)
+    if g.user is None:
+        user = User.query.get(user_id)
+        if user:
+            g.user = user_cache.put(user)
+        else:
+            forget_login()
+
+def login_required(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if g.user is None:
+            return redirect(url_for('login'))
+        return view(*args, **kwargs)
+    return wrapped
+
+# --- Moods ---
+# The diary's emoji picker
+EMOJIS = [
+    "😃","😄","😁","😆","😅","😂","🤣","🥲","🥹","☺️","😊","😇","🙂","🙃","😉","😌",
+    "😍","🥰","😘","😗","😙","😚","😋","😛","😝","😜","🤪","🤨","🧐","🤓","😎","🥸",
+    "🤩","🥳","🙂‍↕️","😏","😒","🙂‍↔️","😞","😔","😟","😕","🙁","☹️","😣","😖","😫","😩",
+    "🥺","😢","😭","😮‍💨","😤","😠","😡","🤬","🤯","😳","🥵","🥶","😱","😨","😰","😥",
+    "😓","🫣","🤗","🫡","🤔","🫢","🤭","🤫","🤥","😶","😶‍🌫️","😐","😑","😬","🫨","🫠",
+    "🙄","😯","😦","😧","😮","😲","🥱","😴","🫩","🤤","😪","😵","😵‍💫","🫥","🤐","🥴",
+    "🤢","🤮","🤧","😷","🤒","🤕","🤑","🤠"
+]
+
+# Emoji -> (category, valence from -2 to +2). Anything not listed here is neutral.
+MOOD_GROUPS = {
+    ("joyful", 2): "😃 😄 😁 😆 😂 🤣 🥹 ☺️ 😊 😇 😍 🥰 🤩 🥳",
+    ("content", 1): "😅 🥲 🙂 🙃 😉 😌 😘 😗 😙 😚 😋 😛 😝 😜 🤪 🤓 😎 🥸 🙂‍↕️ 😏 🤗 🫡 🤭 🤑 🤠",
+    ("tired", -1): "😮‍💨 🥱 😴 🫩 🤤 😪 🫠 🫥",
+    ("unwell", -1): "😵 😵‍💫 🥴 🤢 🤮 🤧 😷 🤒 🤕 🥵 🥶",
+    ("sad", -2): "😞 😔 😟 😕 🙁 ☹️ 😣 😖 😫 😩 🥺 😢 😭 😥 😓",
+    ("angry", -2): "😒 😤 😠 😡 🤬 🙄",
+    ("anxious", -2): "🤯 😳 😱 😨 😰 🫣 😬 🫨",
+}
+
+Mood = namedtuple('Mood', 'category valence')
+
+def build_mood_table(emojis):
+    grouped = {emoji: Mood(category, valence)
+               for (category, valence), members in MOOD_GROUPS.items()
+               for emoji in members.split()}
+    return {emoji: grouped.get(emoji, Mood("neutral", 0)) for emoji in emojis}
+
+MOODS = build_mood_table(EMOJIS)
 
 # --- Routes ---
 @app.route('/')
 def home():
     user = None
-    EMOJIS = [
-        "😃","😄","😁","😆","😅","😂","🤣","🥲","🥹","☺️","😊","😇","🙂","🙃","😉","😌",
-        "😍","🥰","😘","😗","😙","😚","😋","😛","😝","😜","🤪","🤨","🧐","🤓","😎","🥸",
-        "🤩","🥳","🙂‍↕️","😏","😒","🙂‍↔️","😞","😔","😟","😕","🙁","☹️","😣","😖","😫","😩",
-        "🥺","😢","😭","😮‍💨","😤","😠","😡","🤬","🤯","😳","🥵","🥶","😱","😨","😰","😥",
-        "😓","🫣","🤗","🫡","🤔","🫢","🤭","🤫","🤥","😶","😶‍🌫️","😐","😑","😬","🫨","🫠",
-        "🙄","😯","😦","😧","😮","😲","🥱","😴","🫩","🤤","😪","😵","😵‍💫","🫥","🤐","🥴",
-        "🤢","🤮","🤧","😷","🤒","🤕","🤑","🤠"
-    ]
     diary_entries = []
 
-    if 'username' in session:
-        user = User.query.filter_by(username=session['username']).first()
-        diary_entries = DiaryEntry.query.filter_by(author=user).order_by(DiaryEntry.created_at.desc()).limit(7).all()
+    if g.user:
+        user = g.user
+        diary_entries = DiaryEntry.query.filter_by(user_id=user.id).order_by(DiaryEntry.created_at.desc()).limit(7).all()
         
     return render_template('home.html', user=user, diary_entries=diary_entries, EMOJIS=EMOJIS)
 
@@ -178,20 +671,29 @@ def login():
             pass 
         else: 
             user = User.query.filter_by(username=username).first()
-            if not user:
+            try:
+                valid = user is not None and user.check_password(password or "")
+            except PasswordBusy:
+                return render_template('login.html', message="Lots of people are signing in right now. Please try again in a moment."), 503
+            if not valid:
                 message = "Invalid username or password"
             else:
-                if user.role == 'professional':
-                    professional = Professional.query.filter_by(user_id=user.id).first()
+                if user.password_needs_rehash():
+                    try:
+                        user.set_password(password)
+                        db.session.commit()
+                    except PasswordBusy:
+                        # The old hash still works; upgrade it at a quieter login
+                        pass
+                professional = Professional.query.filter_by(user_id=user.id).first() \
+                    if user.role == 'professional' else None
+                if professional:
                     session["professional_id"] = professional.id
-                    session["username"] = user.username
+                    remember_login(user)
                     session['display_name']= professional.full_name
                     return redirect(url_for('professional_dashboard'))
-                elif user.check_password(password):
-                    session["username"] = user.username
-                    return redirect(url_for('home'))
-                else:
-                    message = "Invalid username or password"
+                remember_login(user)
+                return redirect(url_for('home'))
     return render_template('login.html', message=message)
 
 
@@ -209,30 +711,34 @@ def signup():
             return render_template('signup.html', message=message)
 
         new_user = User(username=username, name=name, email=email)
-        new_user.set_password(password)
+        try:
+            new_user.set_password(password)
+        except PasswordBusy:
+            message = "Lots of people are signing up right now. Please try again in a moment."
+            return render_template('signup.html', message=message), 503
         db.session.add(new_user)
         db.session.commit()
-        session["username"] = new_user.username
+        # Replaces any stale record cached under a reused id
+        remember_login(new_user)
         return redirect(url_for('home'))
 
     return render_template('signup.html', message=message)
 
 @app.route('/diary/', methods=['POST'])
+@login_required
 def diary():
-    if 'username' not in session:
-        return redirect(url_for('login'))
-
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     content = request.form.get('diary-entries')
     emoji = request.form.get('emoji')
 
     new_entry = DiaryEntry(
-        content=content,
         emoji=emoji,
-        author=user,
+        user_id=user.id,
         created_at=datetime.now()
     )
+    new_entry.set_content(content)
     db.session.add(new_entry)
+    record_mood(db.session, user.id, new_entry.created_at, emoji, +1)
     db.session.commit()
     return redirect(url_for('home'))
 
@@ -255,121 +761,1043 @@ model = genai.GenerativeModel(
     system_instruction=SYSTEM_PROMPT
 )
 
-def retrieve_response(user_input):
+FALLBACK_RESPONSE = "I'm here for you, but I'm having a small technical hiccup. How else can I help?"
+
+def model_contents(user_input, history=()):
+    # Prior turns (see model_history) go first so Gemini sees the conversation.
+    # Every item has to be a role/parts dict: the SDK rejects a bare string after them.
+    return list(history) + [{'role': 'user', 'parts': [user_input]}]
+
+def generate_response(user_input, history=()):
+    response = model.generate_content(model_contents(user_input, history))
+
+    # 2. Manual Cleaning (No addons needed)
+    # Removes common markdown symbols just in case the AI ignores instructions
+    clean_text = response.text.replace("**", "").replace("__", "").replace("#", "")
+
+    return clean_text.strip()
+
+# --- Chatbot Worker Pool & Circuit Breaker ---
+# Gemini calls run on their own small pool so a slow provider can't pin every request worker
+CHATBOT_WORKERS = 4
+# Calls allowed in flight or queued; beyond this callers get the fallback immediately
+CHATBOT_MAX_PENDING = 16
+CHATBOT_TIMEOUT_SECONDS = 8
+# Calls slower than this count as failures for the breaker even if they succeed
+CHATBOT_LATENCY_SLO_SECONDS = 4
+CHATBOT_BREAKER_FAILURES = 5
+CHATBOT_BREAKER_COOLDOWN_SECONDS = 30
+
+class ChatbotUnavailable(Exception):
+    """The model was not called (breaker open, pool full) or missed its deadline."""
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `cooldown` seconds one
+    trial call is let through and its outcome closes or re-opens the circuit."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def abandon_trial(self):
+        # The caller stopped before the outcome was known; let the next call be the trial
+        with self.lock:
+            self.trial_running = False
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if self.trial_running else "open"
+
+chatbot_executor = ThreadPoolExecutor(max_workers=CHATBOT_WORKERS, thread_name_prefix="gemini")
+chatbot_slots = threading.BoundedSemaphore(CHATBOT_MAX_PENDING)
+chatbot_breaker = CircuitBreaker(CHATBOT_BREAKER_FAILURES, CHATBOT_BREAKER_COOLDOWN_SECONDS)
+
+def call_model(fn, *args):
+    """Run fn on the chatbot pool with a deadline, guarded by the circuit breaker."""
+    if not chatbot_slots.acquire(blocking=False):
+        # Load shedding: don't queue behind a backlog we can't serve in time
+        raise ChatbotUnavailable("chatbot pool full")
+    if not chatbot_breaker.allow():
+        chatbot_slots.release()
+        raise ChatbotUnavailable("circuit open")
+
+    start = time.monotonic()
     try:
-        # Start a chat session with history if needed, or simple generation
-        response = model.generate_content(user_input)
-        
-        # 2. Manual Cleaning (No addons needed)
-        # Removes common markdown symbols just in case the AI ignores instructions
-        clean_text = response.text.replace("**", "").replace("__", "").replace("#", "")
-        
-        return clean_text.strip()
+        future = chatbot_executor.submit(fn, *args)
+    except Exception:
+        chatbot_slots.release()
+        raise
+    # The slot is freed when the call really finishes, even if we stopped waiting for it
+    future.add_done_callback(lambda f: chatbot_slots.release())
+
+    try:
+        result = future.result(timeout=CHATBOT_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        chatbot_breaker.record_failure()
+        raise ChatbotUnavailable("chatbot call timed out")
+    except Exception:
+        chatbot_breaker.record_failure()
+        raise
+
+    if time.monotonic() - start > CHATBOT_LATENCY_SLO_SECONDS:
+        chatbot_breaker.record_failure()
+    else:
+        chatbot_breaker.record_success()
+    return result
+
+# --- Chatbot Response Cache ---
+CHATBOT_CACHE_SIZE = 256
+CHATBOT_CACHE_TTL_SECONDS = 6 * 60 * 60
+# Only short openers ("I feel anxious") are cached; longer messages are personal
+CHATBOT_CACHE_MAX_PROMPT_LENGTH = 80
+# fuzz.ratio score (0-100) at which two differing words count as a typo of each other.
+# Scored per word, so "die"/"diet" (86) or "sad"/"bad" (67) never merge.
+CHATBOT_FUZZY_THRESHOLD = 88
+# Words shorter than this must match exactly
+CHATBOT_FUZZY_MIN_WORD_LENGTH = 4
+# A prompt with one of these is never fuzzy-matched to one without it (or vice versa)
+NEGATIONS = frozenset({
+    "no", "not", "never", "nothing", "nobody", "none", "without", "cannot", "cant",
+    "dont", "doesnt", "didnt", "wont", "isnt", "arent", "wasnt", "werent", "aint",
+    "shouldnt", "couldnt", "wouldnt", "havent", "hasnt",
+})
+# Anything that reads like a crisis goes to the model fresh every time
+CRISIS_PATTERN = re.compile(
+    r"\b(die|dying|dead|death|suicid\w*|kill\w*|overdos\w*|self ?harm\w*|cutting|"
+    r"(hurt|harm|cut|hang) myself|end (it|it all|my life)|want to live|live anymore|"
+    r"better off without me|no reason to live)\b"
+)
+
+def normalize_prompt(text):
+    text = text.lower().replace("'", "").replace("’", "")
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+def is_crisis_prompt(key):
+    return CRISIS_PATTERN.search(key) is not None
+
+def same_words_but_typos(a, b):
+    """True when two normalized prompts differ only by misspelt words.
+
+    Word counts and negations must agree, and every word has to equal or be a
+    close misspelling of its counterpart (after sorting, so word order is free).
+    """
+    words_a, words_b = a.split(), b.split()
+    if len(words_a) != len(words_b):
+        return False
+    if NEGATIONS.intersection(words_a) != NEGATIONS.intersection(words_b):
+        return False
+    for x, y in zip(sorted(words_a), sorted(words_b)):
+        if x == y:
+            continue
+        if min(len(x), len(y)) < CHATBOT_FUZZY_MIN_WORD_LENGTH:
+            return False
+        if fuzz.ratio(x, y) < CHATBOT_FUZZY_THRESHOLD:
+            return False
+    return True
+
+class ResponseCache:
+    """LRU + TTL cache of model replies keyed by normalized prompt.
+
+    Near-duplicates ("i'm so stressed" / "im so stresed!!") are matched with
+    fuzzywuzzy, but only when the prompts have the same words apart from typos.
+    Crisis wording is never cached. Concurrent misses for the same prompt share
+    one upstream call.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires_at, response)
+        self.inflight = {}            # key -> [threading.Event, response, error]
+        self.stats = {'hits': 0, 'fuzzy_hits': 0, 'misses': 0, 'coalesced': 0, 'uncacheable': 0}
+
+    def lookup(self, key):
+        # Caller holds the lock
+        now = time.monotonic()
+        item = self.entries.get(key)
+        if item and item[0] >= now:
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return item[1]
+
+        candidates = [k for k in self.entries if same_words_but_typos(key, k)]
+        match = process.extractOne(key, candidates, scorer=fuzz.token_sort_ratio)
+        if match:
+            item = self.entries[match[0]]
+            if item[0] >= now:
+                self.entries.move_to_end(match[0])
+                self.stats['fuzzy_hits'] += 1
+                return item[1]
+            del self.entries[match[0]]
+        return None
+
+    def cacheable(self, key):
+        return bool(key) and len(key) <= CHATBOT_CACHE_MAX_PROMPT_LENGTH \
+            and not is_crisis_prompt(key)
+
+    def cache_key(self, prompt):
+        key = normalize_prompt(prompt)
+        if not self.cacheable(key):
+            with self.lock:
+                self.stats['uncacheable'] += 1
+            return None
+        return key
+
+    def peek(self, prompt):
+        """Cached reply for prompt, or None (counted as a miss)."""
+        key = self.cache_key(prompt)
+        if key is None:
+            return None
+        with self.lock:
+            cached = self.lookup(key)
+            if cached is None:
+                self.stats['misses'] += 1
+            return cached
+
+    def store(self, prompt, response):
+        key = normalize_prompt(prompt)
+        if not self.cacheable(key):
+            return
+        with self.lock:
+            self.put(key, response)
+
+    def put(self, key, response):
+        # Caller holds the lock
+        self.entries[key] = (time.monotonic() + self.ttl, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get_or_generate(self, prompt, generate):
+        key = self.cache_key(prompt)
+        if key is None:
+            return generate(prompt)
+
+        with self.lock:
+            cached = self.lookup(key)
+            if cached is not None:
+                return cached
+            waiting = self.inflight.get(key)
+            leader = waiting is None
+            if leader:
+                self.stats['misses'] += 1
+                waiting = self.inflight[key] = [threading.Event(), None, None]
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            # Another request is already asking the model this question
+            waiting[0].wait()
+            if waiting[2]:
+                raise waiting[2]
+            return waiting[1]
+
+        try:
+            waiting[1] = generate(prompt)
+        except Exception as e:
+            waiting[2] = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+                if waiting[1] is not None:
+                    self.put(key, waiting[1])
+            waiting[0].set()
+        return waiting[1]
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.entries)
+        answered = stats['hits'] + stats['fuzzy_hits'] + stats['coalesced']
+        lookups = answered + stats['misses']
+        stats['hit_ratio'] = round(answered / lookups, 3) if lookups else 0.0
+        return stats
+
+response_cache = ResponseCache(CHATBOT_CACHE_SIZE, CHATBOT_CACHE_TTL_SECONDS)
+
+def retrieve_response(user_input, history=()):
+    try:
+        if history:
+            # Replies depend on the earlier turns, so only openers go through the cache
+            return call_model(generate_response, user_input, history)
+        return response_cache.get_or_generate(
+            user_input, lambda prompt: call_model(generate_response, prompt)
+        )
     except Exception as e:
-        return "I'm here for you, but I'm having a small technical hiccup. How else can I help?"
+        return FALLBACK_RESPONSE
+
+# --- Chatbot Streaming ---
+class MarkdownScrubber:
+    """Incremental version of the cleaning in generate_response().
+
+    "**" or "__" can be split across two chunks, so a trailing run of "*" / "_"
+    is held back until the next chunk shows how it pairs up.
+    """
+
+    def __init__(self):
+        self.pending = ""
+        self.started = False
+
+    def clean(self, text):
+        return text.replace("**", "").replace("__", "").replace("#", "")
+
+    def feed(self, chunk):
+        text = self.pending + chunk
+        self.pending = ""
+        held = len(text) - len(text.rstrip("*_"))
+        if held:
+            text, self.pending = text[:-held], text[-held:]
+        text = self.clean(text)
+        if not self.started:
+            # Same as the .strip() on a full response, for the leading side
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+    def flush(self):
+        text, self.pending = self.clean(self.pending), ""
+        return text
+
+def stream_response(user_input, history=()):
+    """Yield the reply in cleaned pieces as Gemini produces them.
+
+    Shares the response cache, worker slots and circuit breaker with
+    retrieve_response(); anything that stops the call before the first piece
+    yields the fallback text instead.
+    """
+    cached = None if history else response_cache.peek(user_input)
+    if cached is not None:
+        yield cached
+        return
+    if not chatbot_slots.acquire(blocking=False):
+        yield FALLBACK_RESPONSE
+        return
+    if not chatbot_breaker.allow():
+        chatbot_slots.release()
+        yield FALLBACK_RESPONSE
+        return
+
+    scrubber = MarkdownScrubber()
+    pieces = []
+    start = time.monotonic()
+    deadline = start + CHATBOT_TIMEOUT_SECONDS
+    pending = None  # the pool call currently being waited on
+    outcome = None  # stays None if the client goes away mid-stream
+
+    def on_pool(fn, *args):
+        # Opening the stream and each next() run on the chatbot pool, so a provider
+        # that hangs (even before its first chunk) can't hold this worker past the deadline
+        nonlocal pending
+        pending = chatbot_executor.submit(fn, *args)
+        try:
+            return pending.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeout:
+            raise ChatbotUnavailable("chatbot stream timed out")
+
+    try:
+        chunks = on_pool(lambda: iter(model.generate_content(model_contents(user_input, history), stream=True)))
+        while True:
+            chunk = on_pool(next, chunks, None)
+            if chunk is None:
+                break
+            text = scrubber.feed(chunk.text)
+            if text:
+                pieces.append(text)
+                yield text
+        tail = scrubber.flush()
+        if tail:
+            pieces.append(tail)
+            yield tail
+        outcome = "slow" if time.monotonic() - start > CHATBOT_LATENCY_SLO_SECONDS else "ok"
+    except Exception:
+        outcome = "failed"
+        if not pieces:
+            yield FALLBACK_RESPONSE
+        return
+    finally:
+        if pending is not None and not pending.done():
+            # Abandoned call: the slot is freed when it really finishes
+            pending.add_done_callback(lambda f: chatbot_slots.release())
+        else:
+            chatbot_slots.release()
+        if outcome == "ok":
+            chatbot_breaker.record_success()
+        elif outcome is None:
+            # Nothing learned about the provider, but a half-open trial must not stay stuck
+            chatbot_breaker.abandon_trial()
+        else:
+            chatbot_breaker.record_failure()
+
+    if pieces and not history:
+        response_cache.store(user_input, "".join(pieces).strip())
+
+# --- Chatbot Conversation Store ---
+CHATBOT_GREETING = "Hello! I'm here to listen without judgment. How can I support you today?"
+# Rough token budget for prior turns sent with each message (~4 characters per token)
+CHATBOT_HISTORY_TOKEN_BUDGET = 1000
+# Most recent turns considered for the context window / shown on the page
+CHATBOT_WINDOW_TURNS = 20
+CHATBOT_PAGE_TURNS = 50
+# Summarize once this many turns have fallen out of the window
+CHATBOT_SUMMARY_BATCH = 10
+
+SUMMARY_PROMPT = """Update this running summary of a supportive conversation.
+Keep it under 80 words, plain text, focused on what the user shared and how they feel.
+
+Current summary: {summary}
+
+New turns:
+{turns}"""
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def current_conversation(create=False):
+    """The session's Conversation row, checked against the logged-in user."""
+    user_id = g.user.id if g.user else None
+    conversation_id = session.get('conversation_id')
+    if conversation_id:
+        conversation = Conversation.query.get(conversation_id)
+        if conversation and conversation.user_id == user_id:
+            return conversation
+    if not create:
+        return None
+    conversation = Conversation(user_id=user_id)
+    db.session.add(conversation)
+    db.session.commit()
+    session['conversation_id'] = conversation.id
+    return conversation
+
+def recent_turns(conversation, limit):
+    turns = ConversationTurn.query.filter_by(conversation_id=conversation.id) \
+        .order_by(ConversationTurn.id.desc()).limit(limit).all()
+    return list(reversed(turns))
+
+def model_history(conversation):
+    """Prior turns for Gemini: the rolling summary plus as many recent turns as fit the budget."""
+    budget = CHATBOT_HISTORY_TOKEN_BUDGET
+    window = []
+    for turn in reversed(recent_turns(conversation, CHATBOT_WINDOW_TURNS)):
+        cost = estimate_tokens(turn.text)
+        if cost > budget:
+            break
+        budget -= cost
+        window.append(turn)
+    window.reverse()
+    # Gemini expects the history to start with a user turn
+    while window and window[0].speaker != 'user':
+        window.pop(0)
+
+    history = []
+    if conversation.summary:
+        history.append({'role': 'user', 'parts': [f"Earlier in this conversation: {conversation.summary}"]})
+        history.append({'role': 'model', 'parts': ["Thank you, I remember."]})
+    for turn in window:
+        history.append({'role': 'user' if turn.speaker == 'user' else 'model', 'parts': [turn.text]})
+
+    maybe_schedule_summary(conversation, window[0].id if window else None)
+    return history
+
+def maybe_schedule_summary(conversation, window_start_id):
+    """Fold turns that left the window into the summary, off the request thread."""
+    if window_start_id is None:
+        return
+    unsummarized = ConversationTurn.query.filter(
+        ConversationTurn.conversation_id == conversation.id,
+        ConversationTurn.id > (conversation.summarized_through or 0),
+        ConversationTurn.id < window_start_id
+    ).count()
+    if unsummarized < CHATBOT_SUMMARY_BATCH:
+        return
+    # Best effort: skip when the chatbot pool is busy or the breaker is open
+    if not chatbot_slots.acquire(blocking=False):
+        return
+    if not chatbot_breaker.allow():
+        chatbot_slots.release()
+        return
+    future = chatbot_executor.submit(summarize_conversation, conversation.id, window_start_id)
+    future.add_done_callback(lambda f: chatbot_slots.release())
+
+def summarize_conversation(conversation_id, window_start_id):
+    with app.app_context():
+        conversation = Conversation.query.get(conversation_id)
+        turns = ConversationTurn.query.filter(
+            ConversationTurn.conversation_id == conversation_id,
+            ConversationTurn.id > (conversation.summarized_through or 0),
+            ConversationTurn.id < window_start_id
+        ).order_by(ConversationTurn.id.asc()).all()
+        if not turns:
+            return
+        prompt = SUMMARY_PROMPT.format(
+            summary=conversation.summary or "(none)",
+            turns="\n".join(f"{t.speaker}: {t.text}" for t in turns)
+        )
+        try:
+            conversation.summary = generate_response(prompt)
+        except Exception:
+            chatbot_breaker.record_failure()
+            return
+        chatbot_breaker.record_success()
+        conversation.summarized_through = turns[-1].id
+        db.session.commit()
+
+def add_turn(conversation_id, speaker, text):
+    db.session.add(ConversationTurn(conversation_id=conversation_id, speaker=speaker, text=text))
+    db.session.commit()
 
 # --- Your existing routes follow ---
 
 # --- Chatbot Route ---
 @app.route('/chatbot/', methods=['GET', 'POST'])
 def chatbot():
-    # 1. Initialize history if it's a new session
-    if 'chat_history' not in session:
-        session['chat_history'] = [{
-            'speaker': 'bot', 
-            'text': "Hello! I'm here to listen without judgment. How can I support you today?"
-        }]
+    # Drop the history cookies older sessions still carry
+    session.pop('chat_history', None)
 
     if request.method == 'POST':
         user_input = request.form.get('message', '').strip()
         if user_input:
-            # 2. Get AI response
-            bot_response = retrieve_response(user_input)
-            
-            # 3. Update history
-            # In Flask, we must copy, modify, and re-assign to ensure the session saves
-            history = session['chat_history']
-            history.append({'speaker': 'user', 'text': user_input})
-            history.append({'speaker': 'bot', 'text': bot_response})
-            session['chat_history'] = history
-            
+            conversation = current_conversation(create=True)
+            # 1. Get AI response with the conversation so far
+            bot_response = retrieve_response(user_input, model_history(conversation))
+
+            # 2. Update history
+            add_turn(conversation.id, 'user', user_input)
+            add_turn(conversation.id, 'bot', bot_response)
+
         return redirect(url_for('chatbot'))
 
-    return render_template('chatbot.html', history=session['chat_history'])
+    conversation = current_conversation()
+    history = [{'speaker': 'bot', 'text': CHATBOT_GREETING}]
+    if conversation:
+        history += recent_turns(conversation, CHATBOT_PAGE_TURNS)
+    return render_template('chatbot.html', history=history)
+
+@app.route('/chatbot/stream', methods=['POST'])
+def chatbot_stream():
+    # Same as a chatbot() POST, but the reply is sent as Server-Sent Events while it is generated
+    user_input = request.form.get('message', '').strip()
+    if not user_input:
+        return "", 400
+
+    conversation = current_conversation(create=True)
+    history = model_history(conversation)
+    conversation_id = conversation.id
+    add_turn(conversation_id, 'user', user_input)
+
+    def generate():
+        pieces = []
+        for text in stream_response(user_input, history):
+            pieces.append(text)
+            yield f"data: {json.dumps({'text': text})}\n\n"
+        # Store the finished reply; the request's own context is gone by now
+        with app.app_context():
+            add_turn(conversation_id, 'bot', "".join(pieces).strip())
+        yield "event: done\ndata: {}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/chatbot/cache-stats/')
+def chatbot_cache_stats():
+    # Hit/miss counters for the response cache (each hit is a Gemini call saved)
+    stats = response_cache.snapshot()
+    stats['breaker'] = chatbot_breaker.state
+    return jsonify(stats)
 
 # Optional: clear chat history
 @app.route('/chatbot/clear/')
 def clear_chat():
+    # O(1): the next message starts a new conversation; old turns are not touched
+    session.pop('conversation_id', None)
     session.pop('chat_history', None)
     return redirect(url_for('chatbot'))
 
+# Diary entries shown per page on past-entries
+ENTRIES_PAGE_SIZE = 20
+
+# Markers snippet() wraps matches in; swapped for <mark> after the text is escaped
+HIGHLIGHT_START, HIGHLIGHT_END = "\x02", "\x03"
+
+def render_highlight(text):
+    html = str(escape(text)).replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>")
+    return Markup(html)
+
+def search_diary(user_id, q, cursor=None, limit=ENTRIES_PAGE_SIZE):
+    """One page of a user's entries matching q, best match first.
+
+    Returns (entries, highlights, next_cursor) where highlights maps entry id
+    to an HTML-safe snippet with the matched words marked.
+    """
+    words = fts_match_expression(q)
+    if not words:
+        return [], {}, None
+    match = f'user_id : "{int(user_id)}" AND content : ({words})'
+    snippet = db.func.snippet(db.literal_column('diary_fts'), 0, HIGHLIGHT_START, HIGHLIGHT_END, '…', 24)
+
+    query = db.session.query(DiaryEntry, diary_fts.c.rank, snippet) \
+        .options(load_only(DiaryEntry.id, DiaryEntry.emoji, DiaryEntry.created_at, DiaryEntry.snippet)) \
+        .join(diary_fts, diary_fts.c.rowid == DiaryEntry.id) \
+        .filter(db.text("diary_fts MATCH :match").bindparams(match=match)) \
+        .filter(DiaryEntry.user_id == user_id)
+
+    if cursor:
+        rank, last_id = cursor
+        query = query.filter(db.or_(
+            diary_fts.c.rank > rank,
+            db.and_(diary_fts.c.rank == rank, DiaryEntry.id > last_id)
+        ))
+
+    rows = query.order_by(diary_fts.c.rank, DiaryEntry.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1][1]!r}_{rows[-1][0].id}"
+
+    entries = [entry for entry, _, _ in rows]
+    highlights = {entry.id: render_highlight(text) for entry, _, text in rows}
+    return entries, highlights, next_cursor
+
 @app.route('/past-entries/',methods=['GET','POST'])
+@login_required
+@read_replica
 def past_entries():
-    if 'username' not in session:
-        return redirect(url_for('login'))
-    else:
-        if request.method == "POST":
-            entries = None
-            date = request.form.get("search")
-            search_date = datetime.strptime(date, '%Y-%m-%d').date()
-            entries = DiaryEntry.query.filter(
-                    DiaryEntry.user_id == User.id,
-                    db.func.date(DiaryEntry.created_at) == search_date
-                ).order_by(DiaryEntry.created_at.desc()).all()
-        else:
-            entries = DiaryEntry.query.filter_by(author=User.query.filter_by(username=session['username']).first()).order_by(DiaryEntry.created_at.desc()).all()
-    return render_template('entries.html', entries=entries)
+    if request.method == "POST":
+        # Old single-date search form: turn it into a one-day range
+        date = request.form.get("search")
+        return redirect(url_for('past_entries', start=date, end=date))
+
+    user = g.user
+    q = request.args.get('q', '').strip()
+    if q:
+        entries, highlights, next_cursor = search_diary(
+            user.id, q, decode_search_cursor(request.args.get('after'))
+        )
+        return render_template('entries.html', entries=entries, q=q,
+                               highlights=highlights, next_cursor=next_cursor)
+
+    start = request.args.get('start') or None
+    end = request.args.get('end') or None
+    cursor = decode_cursor(request.args.get('before'))
+
+    # Only the list columns: content stays on disk until an entry is expanded
+    query = DiaryEntry.query.options(load_only(
+        DiaryEntry.id, DiaryEntry.snippet, DiaryEntry.emoji, DiaryEntry.created_at
+    )).filter(DiaryEntry.user_id == user.id)
+
+    try:
+        # Half-open range instead of date(created_at) so the (user_id, created_at) index is used
+        if start:
+            query = query.filter(DiaryEntry.created_at >= datetime.strptime(start, '%Y-%m-%d'))
+        if end:
+            query = query.filter(DiaryEntry.created_at < datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1))
+    except ValueError:
+        start = end = None
+
+    if cursor:
+        created_at, entry_id = cursor
+        query = query.filter(db.or_(
+            DiaryEntry.created_at < created_at,
+            db.and_(DiaryEntry.created_at == created_at, DiaryEntry.id < entry_id)
+        ))
+
+    entries = query.order_by(DiaryEntry.created_at.desc(), DiaryEntry.id.desc()) \
+        .limit(ENTRIES_PAGE_SIZE + 1).all()
+    next_cursor = None
+    if len(entries) > ENTRIES_PAGE_SIZE:
+        entries = entries[:ENTRIES_PAGE_SIZE]
+        next_cursor = encode_cursor(entries[-1].created_at, entries[-1].id)
+
+    return render_template('entries.html', entries=entries, start=start, end=end,
+                           next_cursor=next_cursor)
+
+@app.route('/past-entries/<int:entry_id>/')
+@login_required
+def entry_content(entry_id):
+    # Full text for one expanded entry
+    entry = DiaryEntry.query.filter_by(id=entry_id, user_id=g.user.id).first_or_404()
+    return jsonify(id=entry.id, content=entry.content)
 
 # The updated delete route from the previous response:
 @app.route('/delete_entry/<int:entry_id>', methods=['POST'])
+@login_required
 def delete_entry(entry_id):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-
-    user = User.query.filter_by(username=session['username']).first()
-    if not user:
-        # In case the session key exists but the user doesn't (shouldn't happen)
-        return redirect(url_for('login')) 
+    user = g.user
 
     # CRITICAL: Filter by entry ID AND user ID for security
     entry = DiaryEntry.query.filter_by(id=entry_id, user_id=user.id).first()
     
     if entry:
+        record_mood(db.session, user.id, entry.created_at, entry.emoji, -1)
         db.session.delete(entry)
         db.session.commit()
     return redirect(url_for('past_entries'))
 
 @app.route('/update_entry/<int:entry_id>', methods=['POST'])
+@login_required
 def update_entry(entry_id):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     if request.method=="POST":
         udpated_entry = request.form.get("updated_entry")
+        new_emoji = request.form.get("emoji")
         entry = DiaryEntry.query.filter_by(id=entry_id, user_id=user.id).first()
         if entry:
-            entry.content = udpated_entry
+            entry.set_content(udpated_entry)
+            if new_emoji and new_emoji != entry.emoji:
+                record_mood(db.session, user.id, entry.created_at, entry.emoji, -1)
+                record_mood(db.session, user.id, entry.created_at, new_emoji, +1)
+                entry.emoji = new_emoji
             db.session.commit()
     return redirect(url_for('past_entries'))
 
+# --- Mood Trends ---
+def record_mood(sess, user_id, created_at, emoji, delta):
+    """Add (+1) or remove (-1) one entry's mood from the daily rollup. The caller commits."""
+    mood = MOODS.get(emoji)
+    if mood is None:
+        return
+    day = created_at.date()
+    stmt = sqlite_insert(MoodDay).values(
+        user_id=user_id, day=day, category=mood.category,
+        entries=delta, valence_sum=mood.valence * delta
+    )
+    sess.execute(stmt.on_conflict_do_update(
+        index_elements=[MoodDay.user_id, MoodDay.day, MoodDay.category],
+        set_=dict(entries=MoodDay.entries + stmt.excluded.entries,
+                  valence_sum=MoodDay.valence_sum + stmt.excluded.valence_sum)
+    ))
+    if delta < 0:
+        sess.execute(db.delete(MoodDay).where(
+            MoodDay.user_id == user_id, MoodDay.day == day,
+            MoodDay.category == mood.category, MoodDay.entries <= 0
+        ))
+
+def rebuild_mood_days(user_ids=None):
+    """Recompute MoodDay from the diary in bulk, for everyone or just user_ids."""
+    entries = db.session.query(DiaryEntry.user_id, DiaryEntry.created_at, DiaryEntry.emoji)
+    old = MoodDay.query
+    if user_ids is not None:
+        entries = entries.filter(DiaryEntry.user_id.in_(user_ids))
+        old = old.filter(MoodDay.user_id.in_(user_ids))
+    old.delete(synchronize_session=False)
+
+    rows = {}
+    for user_id, created_at, emoji in entries.yield_per(1000):
+        mood = MOODS.get(emoji)
+        if mood is None or created_at is None:
+            continue
+        key = (user_id, created_at.date(), mood.category)
+        row = rows.setdefault(key, dict(user_id=user_id, day=key[1], category=mood.category,
+                                        entries=0, valence_sum=0))
+        row['entries'] += 1
+        row['valence_sum'] += mood.valence
+    if rows:
+        db.session.execute(db.insert(MoodDay), list(rows.values()))
+    return len(rows)
+
+# SQL for the first day of the bucket a MoodDay falls in
+MOOD_PERIODS = {
+    'day': lambda day: day,
+    'week': lambda day: db.func.date(day, 'weekday 0', '-6 days'),  # Monday
+    'month': lambda day: db.func.date(day, 'start of month'),
+}
+MOOD_DEFAULT_SPAN = {'day': timedelta(days=30), 'week': timedelta(weeks=12), 'month': timedelta(days=365)}
+
+def mood_series(user_id, period, start, end):
+    bucket = MOOD_PERIODS[period](MoodDay.day).label('bucket')
+    rows = db.session.query(
+        bucket, MoodDay.category,
+        db.func.sum(MoodDay.entries), db.func.sum(MoodDay.valence_sum)
+    ).filter(
+        MoodDay.user_id == user_id,
+        MoodDay.day >= start,
+        MoodDay.day <= end
+    ).group_by(bucket, MoodDay.category).order_by(bucket).all()
+
+    points = OrderedDict()
+    for bucket_start, category, entries, valence_sum in rows:
+        point = points.setdefault(str(bucket_start), dict(
+            start=str(bucket_start), entries=0, valence_sum=0, categories={}
+        ))
+        point['entries'] += entries
+        point['valence_sum'] += valence_sum
+        point['categories'][category] = entries
+    for point in points.values():
+        point['average_valence'] = round(point.pop('valence_sum') / point['entries'], 2)
+    return list(points.values())
+
+@app.route('/mood/chart')
+@login_required
+def mood_chart():
+    # Chart data straight from the MoodDay rollup; raw entries are never read
+    period = request.args.get('period', 'day')
+    if period not in MOOD_PERIODS:
+        return jsonify(error="period must be day, week or month"), 400
+    try:
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else date.today()
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') \
+            else end - MOOD_DEFAULT_SPAN[period]
+    except ValueError:
+        return jsonify(error="start and end must be YYYY-MM-DD"), 400
+
+    return jsonify(
+        period=period,
+        start=start.isoformat(),
+        end=end.isoformat(),
+        points=mood_series(g.user.id, period, start, end)
+    )
+
+@app.cli.command("rebuild-moods")
+def rebuild_moods_command():
+    """Recompute the daily mood rollup from every diary entry."""
+    count = rebuild_mood_days()
+    db.session.commit()
+    print(f"Rebuilt {count} mood rows.")
+
+# --- Data Export / Import ---
+# One flat record shape for every kind of row, so NDJSON and CSV carry the same data
+EXPORT_FIELDS = ['type', 'created_at', 'content', 'emoji', 'mood', 'activity_type',
+                 'activity_id', 'duration', 'notes', 'total', 'answers']
+EXPORT_BATCH = 1000
+IMPORT_BATCH = 5000
+
+def export_records(user_id):
+    """Every diary entry, progress row and quiz result of one user, oldest first.
+
+    yield_per streams each query through a server-side cursor in EXPORT_BATCH
+    chunks, so memory stays flat however long the history is.
+    """
+    entries = db.session.query(DiaryEntry.created_at, DiaryEntry.content, DiaryEntry.emoji) \
+        .filter(DiaryEntry.user_id == user_id) \
+        .order_by(DiaryEntry.created_at, DiaryEntry.id).yield_per(EXPORT_BATCH)
+    for created_at, content, emoji in entries:
+        mood = MOODS.get(emoji)
+        yield {'type': 'diary', 'created_at': created_at.isoformat(), 'content': content,
+               'emoji': emoji, 'mood': mood.category if mood else None}
+
+    progress = db.session.query(UserProgress.completed_at, UserProgress.activity_type,
+                                UserProgress.activity_id, UserProgress.duration_completed, UserProgress.notes) \
+        .filter(UserProgress.user_id == user_id) \
+        .order_by(UserProgress.id).yield_per(EXPORT_BATCH)
+    for completed_at, activity_type, activity_id, duration, notes in progress:
+        yield {'type': 'progress', 'created_at': completed_at.isoformat() if completed_at else None,
+               'activity_type': activity_type, 'activity_id': activity_id,
+               'duration': duration, 'notes': notes}
+
+    quizzes = db.session.query(QuizResult.created_at, QuizResult.total, QuizResult.answers) \
+        .filter(QuizResult.user_id == user_id) \
+        .order_by(QuizResult.created_at, QuizResult.id).yield_per(EXPORT_BATCH)
+    for created_at, total, answers in quizzes:
+        yield {'type': 'quiz', 'created_at': created_at.isoformat(), 'total': total,
+               'answers': "".join(str(a) for a in array('B', answers))}
+
+def encode_ndjson(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+def encode_csv(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip framing
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/export')
+@login_required
+def export_data():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return "format must be ndjson or csv", 400
+    encode = encode_ndjson if fmt == 'ndjson' else encode_csv
+    chunks = encode(export_records(g.user.id))
+
+    filename = f"serenify-{g.user.username}-{date.today().isoformat()}.{fmt}"
+    # The body depends on Accept-Encoding, so caches must key on it
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"',
+               'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip']:
+        chunks = gzip_stream(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        chunks = (chunk.encode("utf-8") for chunk in chunks)
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+def read_import(file_storage):
+    """Records from an uploaded NDJSON or CSV file, gzipped or not, read line by line."""
+    stream = file_storage.stream
+    if stream.read(2) == b"\x1f\x8b":
+        stream.seek(0)
+        stream = gzip.GzipFile(fileobj=stream)
+    else:
+        stream.seek(0)
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+    first = text.readline()
+    if first.lstrip().startswith("{"):
+        if first.strip():
+            yield json.loads(first)
+        for line in text:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        # CSV: our own export, or anything with a date and a content/text/entry column
+        reader = csv.DictReader(itertools.chain([first], text))
+        for row in reader:
+            yield {key.strip().lower(): value for key, value in row.items() if key}
+
+def import_rows(user_id, record):
+    """(model, row dict) for one imported record; raises ValueError/KeyError if unusable."""
+    kind = record.get('type') or 'diary'
+    created_at = datetime.fromisoformat(record.get('created_at') or record.get('date'))
+    if kind == 'diary':
+        content = record.get('content') or record.get('text') or record.get('entry')
+        if not content:
+            raise ValueError("empty entry")
+        emoji = record.get('emoji') or None
+        return DiaryEntry, {
+            'user_id': user_id, 'content': content, 'emoji': emoji, 'created_at': created_at,
+            'snippet': content[:DIARY_SNIPPET_LENGTH] + ("…" if len(content) > DIARY_SNIPPET_LENGTH else ""),
+        }
+    if kind == 'progress':
+        return UserProgress, {
+            'user_id': user_id, 'activity_type': record['activity_type'],
+            'activity_id': int(record['activity_id']), 'duration_completed': int(record.get('duration') or 0),
+            'notes': record.get('notes') or None, 'completed_at': created_at,
+        }
+    if kind == 'quiz':
+        answers = str(record['answers'])
+        # Anything else would put impossible totals into the shared histogram
+        if len(answers) != len(QUESTIONS) or not set(answers) <= set("0123"):
+            raise ValueError(f"quiz answers must be {len(QUESTIONS)} digits from 0 to 3")
+        answers = [int(a) for a in answers]
+        return QuizResult, {
+            'user_id': user_id, 'total': sum(answers), 'answers': array('B', answers).tobytes(),
+            'created_at': created_at,
+        }
+    raise ValueError(f"unknown record type {kind}")
+
+def import_records(user_id, records):
+    """Insert records in IMPORT_BATCH-row executemany batches, one transaction each,
+    then bring the rollups the write routes normally maintain up to date."""
+    batches = {DiaryEntry: [], UserProgress: [], QuizResult: []}
+    counts = {'diary': 0, 'progress': 0, 'quiz': 0, 'skipped': 0}
+    names = {DiaryEntry: 'diary', UserProgress: 'progress', QuizResult: 'quiz'}
+    quiz_totals = {}
+
+    def flush():
+        for model, rows in batches.items():
+            if rows:
+                db.session.execute(db.insert(model), rows)
+        db.session.commit()
+        for model, rows in batches.items():
+            counts[names[model]] += len(rows)
+            if model is QuizResult:
+                for row in rows:
+                    quiz_totals[row['total']] = quiz_totals.get(row['total'], 0) + 1
+            rows.clear()
+
+    try:
+        for record in records:
+            try:
+                model, row = import_rows(user_id, record)
+            except (ValueError, KeyError, TypeError):
+                counts['skipped'] += 1
+                continue
+            batches[model].append(row)
+            if sum(len(rows) for rows in batches.values()) >= IMPORT_BATCH:
+                flush()
+        flush()
+    finally:
+        # A file that breaks halfway keeps the batches already committed, so the
+        # rollups are brought up to date either way
+        db.session.rollback()
+        finish_import(user_id, counts, quiz_totals)
+    return counts
+
+def finish_import(user_id, counts, quiz_totals):
+    if quiz_totals:
+        stmt = sqlite_insert(QuizScoreCount)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[QuizScoreCount.total],
+            set_=dict(results=QuizScoreCount.results + stmt.excluded.results)
+        ), [{'total': total, 'results': n} for total, n in quiz_totals.items()])
+    if counts['diary']:
+        rebuild_mood_days([user_id])
+    if counts['progress']:
+        rebuild_rollups([user_id])
+    db.session.commit()
+
+@app.route('/import', methods=['POST'])
+@login_required
+def import_data():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify(error="Choose a file to import"), 400
+    try:
+        counts = import_records(g.user.id, read_import(upload))
+    except (json.JSONDecodeError, UnicodeDecodeError, csv.Error, OSError) as e:
+        db.session.rollback()
+        return jsonify(error=f"Couldn't read that file: {e}"), 400
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(imported=counts)
+    flash(f"Imported {counts['diary']} entries, {counts['progress']} sessions and {counts['quiz']} check-ins.", 'success')
+    return redirect(url_for('past_entries'))
+
 @app.route('/logout/', methods=['POST'])
 def logout():   
-    session.pop('username', None)
+    forget_login()
     return redirect(url_for('home'))
 
 # ---------------- COMMENT SYSTEM (DYNAMIC TOPICS) ----------------
 
 @app.route('/distress/<topic>/')
+@login_required
 def distress_page(topic):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-
-    user = User.query.filter_by(username=session['username']).first()
-
-    comments = Comment.query.filter_by(topic=topic) \
-        .order_by(Comment.created_at.desc()) \
-        .all()
+    user = g.user
 
     # Decide template based on topic
     template_map = {
@@ -385,13 +1813,90 @@ def distress_page(topic):
     if not template:
         return "Invalid topic", 404
 
+    cursor = decode_cursor(request.args.get('before'))
+
+    def render_thread():
+        comments, next_cursor = load_comment_thread(topic, cursor)
+        return render_block(template, 'comment_thread',
+                            comments=comments, topic=topic, next_cursor=next_cursor)
+
+    # The thread is identical for every visitor; only the page around it is per user
+    thread_html = thread_cache.listing(topic, cursor, render_thread)
+
     return render_template(
         template,
-        comments=comments,
+        thread_html=thread_html,
         user=user,
         topic=topic
     )
 
+# Rendered comment-thread fragments keyed by (topic, version, page cursor).
+# add_comment()/delete_comment() bump the topic's version.
+THREAD_CACHE_SIZE = 128
+THREAD_CACHE_TTL_SECONDS = 300  # backstop only
+thread_cache = VersionedCache(THREAD_CACHE_SIZE, THREAD_CACHE_TTL_SECONDS, namespace='thread')
+
+def render_block(template_name, block, **context):
+    """Render one {% block %} of a template on its own, with the usual Flask context."""
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+    return Markup("".join(template.blocks[block](template.new_context(context))))
+
+# Top-level comments shown per page on a distress topic
+COMMENTS_PAGE_SIZE = 20
+
+def encode_cursor(created_at, row_id):
+    """Keyset cursor for (created_at, id) ordered lists, safe to put in a query string."""
+    return f"{created_at.isoformat()}_{row_id}"
+
+def decode_cursor(value):
+    if not value:
+        return None
+    try:
+        created_at, row_id = value.rsplit("_", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError:
+        return None
+
+def load_comment_thread(topic, cursor=None):
+    """One page of a topic's comment tree in two queries, whatever its size.
+
+    Top-level comments come newest first, paged on (created_at, id). Their
+    replies and all authors are fetched together and attached in memory, so
+    the templates never trigger lazy loads. Each top-level comment gets a
+    reply_count. Returns (comments, next_cursor).
+    """
+    query = Comment.query.options(joinedload(Comment.author)).filter(
+        Comment.topic == topic,
+        Comment.parent_id.is_(None)
+    )
+    if cursor:
+        created_at, comment_id = cursor
+        query = query.filter(db.or_(
+            Comment.created_at < created_at,
+            db.and_(Comment.created_at == created_at, Comment.id < comment_id)
+        ))
+    comments = query.order_by(Comment.created_at.desc(), Comment.id.desc()) \
+        .limit(COMMENTS_PAGE_SIZE + 1).all()
+
+    next_cursor = None
+    if len(comments) > COMMENTS_PAGE_SIZE:
+        comments = comments[:COMMENTS_PAGE_SIZE]
+        next_cursor = encode_cursor(comments[-1].created_at, comments[-1].id)
+
+    replies_by_parent = {c.id: [] for c in comments}
+    if comments:
+        replies = Comment.query.options(joinedload(Comment.author)) \
+            .filter(Comment.parent_id.in_(list(replies_by_parent))) \
+            .order_by(Comment.created_at.asc(), Comment.id.asc()).all()
+        for reply in replies:
+            replies_by_parent[reply.parent_id].append(reply)
+
+    for c in comments:
+        set_committed_value(c, 'replies', replies_by_parent[c.id])
+        c.reply_count = len(replies_by_parent[c.id])
+    return comments, next_cursor
+
 # 26 Mental Health Questions
 QUESTIONS = [
     "How often have you felt little interest or pleasure in doing things?",
@@ -429,16 +1934,49 @@ OPTIONS = [
     (3, "Nearly every day")
 ]
 
+# Past results shown in the "your trend" line
+QUIZ_TREND_LENGTH = 10
+
+def save_quiz_result(user_id, answers):
+    """Store one submission and count it in the population histogram."""
+    result = QuizResult(user_id=user_id, total=sum(answers),
+                        answers=array('B', answers).tobytes(), created_at=datetime.now())
+    db.session.add(result)
+    db.session.execute(sqlite_insert(QuizScoreCount).values(total=result.total, results=1)
+                       .on_conflict_do_update(index_elements=[QuizScoreCount.total],
+                                              set_=dict(results=QuizScoreCount.results + 1)))
+    db.session.commit()
+    return result
+
+def quiz_percentile(total):
+    """Share of stored results scoring below total (ties count half), from the
+    histogram's at most 79 rows rather than the results table."""
+    below = equal = count = 0
+    for score, results in db.session.query(QuizScoreCount.total, QuizScoreCount.results):
+        count += results
+        if score < total:
+            below += results
+        elif score == total:
+            equal += results
+    return round(100 * (below + equal / 2) / count) if count else None
+
+def quiz_trend(user_id):
+    latest = db.session.query(QuizResult.total, QuizResult.created_at) \
+        .filter(QuizResult.user_id == user_id) \
+        .order_by(QuizResult.created_at.desc()).limit(QUIZ_TREND_LENGTH).all()
+    return [{'score': total, 'date': created_at.strftime('%b %d')} for total, created_at in reversed(latest)]
+
 @app.route('/quiz/', methods=['GET', 'POST'])
 def health_quiz():
     results = None
     if request.method == 'POST':
         # Collect all scores from the form
         try:
-            total_score = 0
+            answers = []
             for i in range(len(QUESTIONS)):
                 # Each radio group is named 'q0', 'q1', etc.
-                total_score += int(request.form.get(f'q{i}', 0))
+                answers.append(min(max(int(request.form.get(f'q{i}', 0)), 0), 3))
+            total_score = sum(answers)
             
             # Simple scoring logic
             if total_score < 20:
@@ -449,16 +1987,18 @@ def health_quiz():
                 status, color = "High Distress", "#e74c3c"
                 
             results = {"score": total_score, "status": status, "color": color}
+            if g.user:
+                save_quiz_result(g.user.id, answers)
+                results["percentile"] = quiz_percentile(total_score)
+                results["trend"] = quiz_trend(g.user.id)
         except ValueError:
             results = {"error": "Please answer all questions."}
 
-    return render_template('quiz.html', questions=QUESTIONS, options=OPTIONS, results=results)
+    return render_template('Quiz.html', questions=QUESTIONS, options=OPTIONS, results=results)
 @app.route('/comment/<topic>/', methods=['POST'])
+@login_required
 def add_comment(topic):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     comment_text = request.form.get("comment_text", "").strip()
     parent_id = request.form.get('parent_id')  
     if comment_text:
@@ -479,17 +2019,16 @@ def add_comment(topic):
                 created_at=datetime.now()
             )
             db.session.add(new_comment)
+            thread_cache.invalidate_kind(topic)
             db.session.commit()
 
     return redirect(url_for('distress_page', topic=topic))
 
 
 @app.route('/delete_comment/<topic>/<int:comment_id>/', methods=['POST'])
+@login_required
 def delete_comment(topic, comment_id):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
 
     comment = Comment.query.filter_by(
         id=comment_id,
@@ -499,16 +2038,223 @@ def delete_comment(topic, comment_id):
 
     if comment:
         db.session.delete(comment)
+        thread_cache.invalidate_kind(topic)
         db.session.commit()
 
     return redirect(url_for('distress_page', topic=topic))
 
+# --- Media Store ---
+# Uploads are copied in chunks into MEDIA_ROOT/<first 2 hex>/<sha256>, hashing as
+# they go, so a file uploaded twice is stored once. Columns like YogaPose.image_url
+# hold the sha256; older rows still hold a filename under static/.
+MB = 1024 * 1024
+MEDIA_LIMITS = {'image': 10 * MB, 'video': 200 * MB, 'certificate': 10 * MB}
+# Allowed extensions per kind and the Content-Type each is served with. The
+# client's own Content-Type header is never trusted.
+MEDIA_EXTENSIONS = {
+    'image': {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+              '.gif': 'image/gif', '.webp': 'image/webp'},
+    'video': {'.mp4': 'video/mp4', '.mov': 'video/quicktime', '.m4v': 'video/mp4',
+              '.webm': 'video/webm'},
+    'certificate': {'.pdf': 'application/pdf', '.png': 'image/png', '.jpg': 'image/jpeg',
+                    '.jpeg': 'image/jpeg'},
+}
+MEDIA_CONTENT_TYPES = {ct for types in MEDIA_EXTENSIONS.values() for ct in types.values()}
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MEDIA_KEY = re.compile(r"[0-9a-f]{64}")
+
+class UploadRejected(Exception):
+    pass
+
+def media_path(sha256):
+    return os.path.join(app.config['MEDIA_ROOT'], sha256[:2], sha256)
+
+def store_upload(file_storage, kind):
+    """Stream an upload into the media store and return its sha256.
+
+    Raises UploadRejected for a disallowed type or a file over the kind's limit.
+    New content gets a MediaBlob row and is queued for post-processing.
+    """
+    ext = os.path.splitext(file_storage.filename)[1].lower()
+    if ext not in MEDIA_EXTENSIONS[kind]:
+        raise UploadRejected(f"{ext or 'That file type'} isn't allowed here.")
+    limit = MEDIA_LIMITS[kind]
+
+    tmp_dir = os.path.join(app.config['MEDIA_ROOT'], 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    raise UploadRejected(f"Files of this kind can be at most {limit // MB} MB.")
+                digest.update(chunk)
+                out.write(chunk)
+        sha256 = digest.hexdigest()
+        path = media_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(tmp_path)  # already stored
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    inserted = db.session.execute(sqlite_insert(MediaBlob).values(
+        sha256=sha256, kind=kind, size=size, status='pending', created_at=datetime.now(),
+        content_type=MEDIA_EXTENSIONS[kind][ext]
+    ).on_conflict_do_nothing()).rowcount
+    db.session.commit()
+    if inserted:
+        media_executor.submit(process_media, sha256)
+    return sha256
+
+# File signatures each kind may start with, and the Content-Type they prove
+MEDIA_SIGNATURES = {
+    'image': {b"\x89PNG": 'image/png', b"\xff\xd8\xff": 'image/jpeg', b"GIF8": 'image/gif',
+              b"RIFF": 'image/webp'},
+    'video': {b"\x1a\x45\xdf\xa3": 'video/webm'},  # mp4/mov are checked for "ftyp" below
+    'certificate': {b"%PDF": 'application/pdf', b"\x89PNG": 'image/png',
+                    b"\xff\xd8\xff": 'image/jpeg'},
+}
+
+def sniff_content_type(kind, head, claimed):
+    """The Content-Type the file's first bytes show it to be, or None if they don't fit the kind."""
+    if kind == 'video' and head[4:8] == b"ftyp":
+        # mp4 and mov share the box layout; keep the one the extension picked
+        return claimed if claimed in ('video/mp4', 'video/quicktime') else 'video/mp4'
+    for signature, content_type in MEDIA_SIGNATURES[kind].items():
+        if head.startswith(signature):
+            return content_type
+    return None
+
+def mp4_duration(path):
+    """Duration from the mvhd box of an mp4/mov, or None. Reads only box headers."""
+    with open(path, 'rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        containers = {b"moov"}
+        while f.tell() + 8 <= end:
+            start = f.tell()
+            size, box = struct.unpack(">I4s", f.read(8))
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+            elif size == 0:
+                size = end - start
+            if size < 8:
+                return None
+            if box in containers:
+                end = start + size  # descend into it
+                continue
+            if box == b"mvhd":
+                version = f.read(1)[0]
+                f.read(3)
+                if version == 1:
+                    _, _, timescale, duration = struct.unpack(">QQIQ", f.read(28))
+                else:
+                    _, _, timescale, duration = struct.unpack(">IIII", f.read(16))
+                return duration / timescale if timescale else None
+            f.seek(start + size)
+    return None
+
+def probe_duration(path):
+    if shutil.which("ffprobe"):
+        try:
+            out = subprocess.run(
+                ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+                capture_output=True, text=True, timeout=30
+            ).stdout.strip()
+            return float(out)
+        except (ValueError, subprocess.SubprocessError):
+            pass
+    try:
+        return mp4_duration(path)
+    except (OSError, struct.error, IndexError):
+        return None
+
+def process_media(sha256):
+    """Background: check a new blob is what it claims to be and probe video duration."""
+    with app.app_context():
+        blob = MediaBlob.query.get(sha256)
+        if blob is None:
+            return
+        path = media_path(sha256)
+        with open(path, 'rb') as f:
+            head = f.read(16)
+        content_type = sniff_content_type(blob.kind, head, blob.content_type)
+        if content_type is None:
+            blob.status = 'rejected'
+            db.session.commit()
+            return
+        blob.content_type = content_type
+        blob.status = 'ready'
+        db.session.commit()
+        if blob.kind == 'video':
+            # Can take a while; the file is already servable meanwhile
+            blob.duration_seconds = probe_duration(path)
+            db.session.commit()
+
+media_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="media")
+
+MEDIA_MAX_AGE = 365 * 24 * 3600
+
+def immutable(response, sha256):
+    # The URL is the content hash, so a response can never go stale
+    response.set_etag(sha256)
+    response.cache_control.public = True
+    response.cache_control.max_age = MEDIA_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/media/<sha256>')
+def media(sha256):
+    if not MEDIA_KEY.fullmatch(sha256):
+        return "Not found", 404
+    # Revalidation needs no lookup: the ETag is the name. Only the exact tag counts;
+    # "If-None-Match: *" falls through so a missing or rejected blob still gets its 404.
+    if request.if_none_match.is_strong(sha256):
+        return immutable(Response(status=304), sha256)
+
+    blob = MediaBlob.query.get(sha256)
+    # Pending blobs haven't had their signature checked yet
+    if blob is None or blob.status != 'ready':
+        return "Not found", 404
+    # Rows stored before types were derived server-side may hold a client's claim
+    content_type = blob.content_type if blob.content_type in MEDIA_CONTENT_TYPES \
+        else 'application/octet-stream'
+
+    accel = app.config['MEDIA_ACCEL_PREFIX']
+    if accel:
+        # nginx streams the file itself (sendfile) and answers Range requests
+        response = Response(mimetype=content_type)
+        response.headers['X-Accel-Redirect'] = f"{accel.rstrip('/')}/{sha256[:2]}/{sha256}"
+    else:
+        # Handles Range/If-Range (206) and If-None-Match (304); full responses go
+        # out through wsgi.file_wrapper, which gunicorn and uwsgi serve with sendfile
+        response = send_file(media_path(sha256), mimetype=content_type,
+                             conditional=True, etag=sha256, max_age=MEDIA_MAX_AGE)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return immutable(response, sha256)
+
+@app.template_global()
+def media_url(value, legacy_folder):
+    """URL for a stored upload; older uploads are plain files in static/<legacy_folder>."""
+    if MEDIA_KEY.fullmatch(value):
+        return url_for('media', sha256=value)
+    return url_for('static', filename=f"{legacy_folder}/{value}")
+
 @app.route('/apply_professional/', methods=['GET','POST'])
+@login_required
 def apply_professional():   
-    if 'username' not in session:
-        return redirect(url_for('login'))
-
-    user = User.query.filter_by(username=session['username']).first()
+    # Needs the ORM row: the role is changed below
+    user = User.query.get(g.user.id)
 
     if request.method == 'POST':
         profession = request.form.get('profession')
@@ -519,12 +2265,11 @@ def apply_professional():
         certificate_filename = None
 
         if certificate_file and certificate_file.filename:
-            certificate_filename = certificate_file.filename
-
-            cert_folder = os.path.join(app.static_folder, 'certificates')
-            os.makedirs(cert_folder, exist_ok=True)
-
-            certificate_file.save(os.path.join(cert_folder, certificate_filename))
+            try:
+                certificate_filename = store_upload(certificate_file, 'certificate')
+            except UploadRejected as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('profession'))
         professional = Professional(
             user_id=user.id,
             bio=bio,
@@ -537,63 +2282,150 @@ def apply_professional():
         user.role = 'professional'  # Update user role
         db.session.add(professional)
         db.session.commit()
+        user_cache.invalidate(user.id)
 
     return redirect(url_for('professional_dashboard'))
 @app.route("/appointment/<int:appt_id>/accept", methods=["POST"])
 def accept_appointment(appt_id):
     appt = Appointment.query.get_or_404(appt_id)
-    appt.status = "accepted"
-    db.session.commit()
+    change_appointment_status(appt, "accepted")
     return redirect(url_for("professional_dashboard"))
 
 
 @app.route("/appointment/<int:appt_id>/decline", methods=["POST"])
 def decline_appointment(appt_id):
     appt = Appointment.query.get_or_404(appt_id)
-    appt.status = "declined"
-    db.session.commit()
+    change_appointment_status(appt, "declined")
     return redirect(url_for("professional_dashboard"))
 
 @app.route('/profession/', methods=['GET','POST'])  
+@login_required
 def profession():
-    if 'username' not in session:
-        return redirect(url_for('login'))
     return render_template('profession_application.html')
 
 @app.route('/profession_logout/', methods=['GET','POST'])
 def profession_logout():
-    session.pop('username', None)
+    forget_login()
     return redirect(url_for('home'))
 
+# --- Professional Directory Search ---
+PROFESSIONALS_PAGE_SIZE = 12
+
+def fts_match_expression(text):
+    """User text -> safe FTS5 query: every word must match, as a prefix."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{w}"*' for w in words)
+
+def search_professionals(q=None, profession=None, min_experience=None, cursor=None,
+                         limit=PROFESSIONALS_PAGE_SIZE):
+    """One page of the directory. Returns (professionals, next_cursor).
+
+    With a query, results are ranked by bm25 over full_name, profession and bio
+    and paged on (rank, id); otherwise they are paged on id.
+    """
+    match = fts_match_expression(q) if q else ""
+    if match:
+        query = db.session.query(Professional, professional_fts.c.rank) \
+            .join(professional_fts, professional_fts.c.rowid == Professional.id) \
+            .filter(db.text("professional_fts MATCH :match").bindparams(match=match))
+    else:
+        query = db.session.query(Professional, db.literal(0.0))
+
+    query = query.filter(Professional.verified == False)
+    if profession:
+        query = query.filter(Professional.profession == profession)
+    if min_experience:
+        query = query.filter(Professional.experience >= min_experience)
+
+    if cursor:
+        rank, last_id = cursor
+        if match:
+            query = query.filter(db.or_(
+                professional_fts.c.rank > rank,
+                db.and_(professional_fts.c.rank == rank, Professional.id > last_id)
+            ))
+        else:
+            query = query.filter(Professional.id > last_id)
+
+    order = [professional_fts.c.rank, Professional.id] if match else [Professional.id]
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1][1]!r}_{rows[-1][0].id}"
+    return [p for p, _ in rows], next_cursor
+
+def decode_search_cursor(value):
+    if not value:
+        return None
+    try:
+        rank, last_id = value.rsplit("_", 1)
+        return float(rank), int(last_id)
+    except ValueError:
+        return None
+
+def search_args():
+    return dict(
+        q=request.args.get('q', '').strip() or None,
+        profession=request.args.get('profession') or None,
+        min_experience=request.args.get('min_experience', type=int),
+        cursor=decode_search_cursor(request.args.get('after')),
+    )
+
+@app.route("/support/search")
+@login_required
+def professional_search():
+    professionals, next_cursor = search_professionals(**search_args())
+    return jsonify(
+        professionals=[{
+            'id': p.id,
+            'full_name': p.full_name,
+            'profession': p.profession,
+            'experience': p.experience,
+            'bio': p.bio,
+        } for p in professionals],
+        next_cursor=next_cursor
+    )
+
 @app.route("/support/", methods=["GET", "POST"])
+@login_required
+@read_replica
 def professional_support():
-    if "username" not in session:
-        return redirect(url_for("login"))
-
-    user = User.query.filter_by(username=session["username"]).first()
+    user = g.user
     today = date.today()
-    professionals = Professional.query.filter_by(verified=False).all()
+    args = search_args()
+    professionals, next_cursor = search_professionals(**args)
 
-    # 🔑 Fetch user's appointments
-    appointments = Appointment.query.filter_by(user_id=user.id).all()
+    # 🔑 Fetch user's appointments, only for the professionals on this page
+    appointments = Appointment.query.filter(
+        Appointment.user_id == user.id,
+        Appointment.professional_id.in_([p.id for p in professionals])
+    ).order_by(Appointment.date.asc()).all() if professionals else []
 
     # 🔑 Create lookup: { professional_id : appointment }
     appt_map = {appt.professional_id: appt for appt in appointments}
 
+    professions = [row[0] for row in db.session.query(Professional.profession)
+                   .filter_by(verified=False).distinct().order_by(Professional.profession)]
+
     return render_template(
         "professional_support.html",
         user=user,
         today = today,
         professionals=professionals,
-        appt_map=appt_map
+        appt_map=appt_map,
+        q=args['q'],
+        profession=args['profession'],
+        min_experience=args['min_experience'],
+        professions=professions,
+        next_cursor=next_cursor
     )
 
 
 @app.route("/appointments/")
+@login_required
 def appointments():
-    if 'username' not in session:
-        return redirect(url_for('login'))
-
     professional = Professional.query.get(session["professional_id"])
     appointments = Appointment.query.filter_by(professional_id=professional.id).order_by(Appointment.date.desc()).all()
 
@@ -603,67 +2435,193 @@ def appointments():
         appointments=appointments
     )
 MAX_APPOINTMENTS_PER_DAY = 5
+TIME_SLOTS = [
+    "10:00 - 11:00",
+    "11:00 - 12:00",
+    "12:00 - 01:00",
+    "02:00 - 03:00",
+    "03:00 - 04:00",
+]
+
+# --- Booking ---
+ACTIVE_STATUSES = ("pending", "accepted")
+
+def take_day_capacity(sess, professional_id, day):
+    """Atomically claim one of the day's MAX_APPOINTMENTS_PER_DAY places. False when full."""
+    sess.execute(sqlite_insert(AppointmentDayCount).values(
+        professional_id=professional_id, date=day, booked=0
+    ).on_conflict_do_nothing())
+    result = sess.execute(db.update(AppointmentDayCount).where(
+        AppointmentDayCount.professional_id == professional_id,
+        AppointmentDayCount.date == day,
+        AppointmentDayCount.booked < MAX_APPOINTMENTS_PER_DAY
+    ).values(booked=AppointmentDayCount.booked + 1))
+    return result.rowcount == 1
+
+def release_day_capacity(sess, professional_id, day):
+    sess.execute(db.update(AppointmentDayCount).where(
+        AppointmentDayCount.professional_id == professional_id,
+        AppointmentDayCount.date == day,
+        AppointmentDayCount.booked > 0
+    ).values(booked=AppointmentDayCount.booked - 1))
+
+def book_appointment(sess, **fields):
+    """Reserve a slot in one transaction. Returns (appointment, None) or (None, message).
+
+    The day counter update is guarded by its own WHERE clause and the slot by
+    the uq_appointment_active_slot index, so concurrent requests can't
+    double-book or overfill a day; a failed booking rolls back both.
+    """
+    day, time_slot = fields['date'], fields['time_slot']
+    # The unique index compares raw strings, so "10:00 - 11:00 " would dodge it
+    if time_slot not in TIME_SLOTS:
+        return None, "Please choose one of the listed time slots."
+    try:
+        if not take_day_capacity(sess, fields['professional_id'], day):
+            sess.rollback()
+            return None, "This professional is fully booked for this date."
+        appt = Appointment(status="pending", **fields)
+        sess.add(appt)
+        sess.flush()
+    except IntegrityError:
+        sess.rollback()
+        return None, f"The {time_slot} slot on {day} is already reserved."
+    sess.commit()
+    return appt, None
+
+def set_appointment_status(appt, status):
+    """Move an appointment between statuses, keeping the day counter in step.
+
+    Declining releases its place; re-activating a declined one has to win the
+    slot and a place again. Returns False (and changes nothing) if it can't.
+    """
+    was_active = appt.status in ACTIVE_STATUSES
+    now_active = status in ACTIVE_STATUSES
+    try:
+        if was_active and not now_active:
+            release_day_capacity(db.session, appt.professional_id, appt.date)
+        elif now_active and not was_active:
+            if not take_day_capacity(db.session, appt.professional_id, appt.date):
+                db.session.rollback()
+                return False
+        appt.status = status
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    db.session.commit()
+    availability_cache.invalidate(appt.professional_id)
+    return True
+
+def change_appointment_status(appt, status):
+    # set_appointment_status() for the dashboard buttons: tell the professional when it refused
+    if not set_appointment_status(appt, status):
+        flash(f"Couldn't mark the {appt.date} {appt.time_slot} booking as {status}: "
+              "that slot or day has been taken since.", "danger")
+
+# --- Availability ---
+# Days ahead (from today) covered by the availability calendar
+AVAILABILITY_DAYS = 30
+AVAILABILITY_CACHE_TTL_SECONDS = 60
+
+availability_cache = TTLCache(512, AVAILABILITY_CACHE_TTL_SECONDS)
+
+def compute_availability(professional_id, start, days):
+    """Free slots per day for one professional, from a single grouped query."""
+    end = start + timedelta(days=days)
+    booked = db.session.query(
+        Appointment.date, Appointment.time_slot, db.func.count(Appointment.id)
+    ).filter(
+        Appointment.professional_id == professional_id,
+        Appointment.date >= start,
+        Appointment.date < end,
+        Appointment.status.in_(["pending", "accepted"])
+    ).group_by(Appointment.date, Appointment.time_slot).all()
+
+    taken = {}
+    for day, slot, count in booked:
+        taken.setdefault(day, {})[slot] = count
+
+    calendar = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        day_taken = taken.get(day, {})
+        full = sum(day_taken.values()) >= MAX_APPOINTMENTS_PER_DAY
+        calendar.append({
+            'date': day,
+            'slots': [{'slot': slot, 'free': not full and slot not in day_taken}
+                      for slot in TIME_SLOTS],
+        })
+    return calendar
+
+def get_availability(professional_id):
+    """Cached calendar for today .. today + AVAILABILITY_DAYS.
+
+    Invalidated on booking, accept and decline; the TTL covers other workers.
+    """
+    today = date.today()
+    cached = availability_cache.get(professional_id)
+    if cached and cached[0] == today:
+        return cached[1]
+    calendar = compute_availability(professional_id, today, AVAILABILITY_DAYS)
+    availability_cache.set(professional_id, (today, calendar))
+    return calendar
+
+@app.route("/appointment/<int:professional_id>/availability")
+@login_required
+def appointment_availability(professional_id):
+    Professional.query.get_or_404(professional_id)
+    days = min(request.args.get('days', AVAILABILITY_DAYS, type=int), AVAILABILITY_DAYS)
+    calendar = get_availability(professional_id)[:max(days, 0)]
+    return jsonify(days=[
+        {'date': day['date'].isoformat(),
+         'free_slots': [s['slot'] for s in day['slots'] if s['free']]}
+        for day in calendar
+    ])
+
 @app.route("/appointment/<int:professional_id>", methods=["GET", "POST"])
+@login_required
 def appointment(professional_id):
-    if "username" not in session:
-        return redirect(url_for("login"))
-
-    user = User.query.filter_by(username=session["username"]).first_or_404()
+    user = g.user
     professional = Professional.query.get_or_404(professional_id)
     today = date.today()
     message = success = None
 
     if request.method == "POST":
-        appointment_date = datetime.strptime(
-            request.form["appointment_date"], "%Y-%m-%d"
-        ).date()
+        # The availability grid posts "YYYY-MM-DD|slot" as one radio value
+        if "slot_choice" in request.form:
+            chosen_date, _, chosen_slot = request.form["slot_choice"].partition("|")
+        else:
+            chosen_date, chosen_slot = request.form["appointment_date"], request.form["time_slot"]
+        try:
+            appointment_date = datetime.strptime(chosen_date, "%Y-%m-%d").date()
+        except ValueError:
+            appointment_date = None
+
+        # Error 0: Tampered or half-filled form
+        if appointment_date is None or not chosen_slot:
+            message = "Please choose a date and time slot."
 
         # Error 1: Past Dates
-        if appointment_date < today:
+        elif appointment_date < today:
             message = "You cannot book past dates."
         
         else:
-            time_slot = request.form["time_slot"]
-
-            # FIX 1: Check if slot is taken (Both Pending AND Accepted statuses)
-            # This ensures that if Person A books 10 AM on the 28th, Person B cannot.
-            is_taken = Appointment.query.filter(
-                Appointment.professional_id == professional.id,
-                db.func.date(Appointment.date) == appointment_date,
-                Appointment.time_slot == time_slot,
-                Appointment.status.in_(["pending", "accepted"]) 
-            ).first()
-
-            if is_taken:
-                message = f"The {time_slot} slot on {appointment_date} is already reserved."
-            
-            else:
-                # FIX 2: Check daily limit for that specific professional on that specific day
-                daily_count = Appointment.query.filter(
-                    Appointment.professional_id == professional.id,
-                    db.func.date(Appointment.date) == appointment_date,
-                    Appointment.status != "declined" # Don't count declined ones against the limit
-                ).count()
-
-                if daily_count >= MAX_APPOINTMENTS_PER_DAY:
-                    message = "This professional is fully booked for this date."
-                
-                else:
-                    # Logic is clear, create the appointment
-                    appt = Appointment(
-                        user_id=user.id,
-                        professional_id=professional.id,
-                        full_name=request.form["full_name"],
-                        mobile=request.form["mobile"],
-                        # Store only the date part or use combine for DateTime
-                        date=appointment_date, 
-                        time_slot=time_slot,
-                        notes=request.form.get("notes"),
-                        status="pending"
-                    )
-                    db.session.add(appt)
-                    db.session.commit()
-                    success = "Your appointment request has been sent!"
+            time_slot = chosen_slot
+
+            appt, message = book_appointment(
+                db.session,
+                user_id=user.id,
+                professional_id=professional.id,
+                full_name=request.form["full_name"],
+                mobile=request.form["mobile"],
+                date=appointment_date,
+                time_slot=time_slot,
+                notes=request.form.get("notes")
+            )
+            if appt:
+                availability_cache.invalidate(professional.id)
+                success = "Your appointment request has been sent!"
 
     return render_template(
         "appointment.html",
@@ -672,7 +2630,8 @@ def appointment(professional_id):
         success=success,
         today=today,
          user= user,
-          date=date # Pass today to the template to restrict the date picker
+          date=date, # Pass today to the template to restrict the date picker
+        availability=get_availability(professional.id)
     )
 
 # ----------------- Update Appointment Status -----------------
@@ -682,8 +2641,7 @@ def update_appointment_status(appointment_id, action):
         return redirect(url_for("professional_login"))
 
     appointment = Appointment.query.get_or_404(appointment_id)
-    appointment.status = "accepted" if action == "accept" else "declined"
-    db.session.commit()
+    change_appointment_status(appointment, "accepted" if action == "accept" else "declined")
 
     return redirect(url_for("professional_dashboard"))
 
@@ -720,13 +2678,81 @@ def professional_dashboard():
         total_appointments=len(upcoming_appointments)
     )
 
+# How many chat bubbles are sent per page (initial render, polls and "load older")
+CHAT_PAGE_SIZE = 50
+
+def serialize_chat_message(m, user):
+    return {
+        'id': m.id,
+        'side': "sent" if m.sender_id == user.id else "received",
+        'message': m.message,
+    }
+
+# --- Chat push channel (Server-Sent Events) ---
+# Seconds between keep-alive comments on an idle stream
+CHAT_HEARTBEAT_SECONDS = 15
+# Streams are closed after this long; EventSource reconnects with Last-Event-ID
+CHAT_STREAM_LIFETIME_SECONDS = 300
+# Open streams allowed per worker process before new clients fall back to polling
+MAX_CHAT_STREAMS = 200
+
+class ChatBroker:
+    """In-process pub/sub: one queue per open stream, grouped by appointment.
+
+    Only streams held by this worker process are notified. The chat page keeps a
+    slow since_id poll running alongside the stream to pick up messages posted
+    through other workers.
+    """
+
+    def __init__(self, max_streams):
+        self.max_streams = max_streams
+        self.lock = threading.Lock()
+        self.channels = {}  # appointment_id -> set of queues
+        self.open_streams = 0
+
+    def subscribe(self, appointment_id):
+        with self.lock:
+            if self.open_streams >= self.max_streams:
+                return None
+            q = queue.Queue()
+            self.channels.setdefault(appointment_id, set()).add(q)
+            self.open_streams += 1
+            return q
+
+    def unsubscribe(self, appointment_id, q):
+        with self.lock:
+            subscribers = self.channels.get(appointment_id)
+            if subscribers and q in subscribers:
+                subscribers.discard(q)
+                self.open_streams -= 1
+                if not subscribers:
+                    del self.channels[appointment_id]
+
+    def publish(self, appointment_id, payload):
+        with self.lock:
+            subscribers = list(self.channels.get(appointment_id, ()))
+        for q in subscribers:
+            q.put(payload)
+
+chat_broker = ChatBroker(MAX_CHAT_STREAMS)
+
+def is_chat_participant(appt, user):
+    # The client who booked, or the professional the session is with
+    return appt.user_id == user.id or appt.professional_rel.user_id == user.id
+
+def sse_event(m, user_id):
+    side = "sent" if m['sender_id'] == user_id else "received"
+    data = json.dumps({'id': m['id'], 'side': side, 'message': m['message']})
+    return f"id: {m['id']}\ndata: {data}\n\n"
+
 @app.route('/chat/<int:appt_id>/', methods=['GET', 'POST'])
+@login_required
 def session_chat(appt_id):
-    if 'username' not in session: return redirect(url_for('login'))
-    user = User.query.filter_by(username=session['username']).first()
-    if not user: return redirect(url_for('login'))
+    user = g.user
     
     appt = Appointment.query.get_or_404(appt_id)
+    if not is_chat_participant(appt, user):
+        return Response("Not your session", status=403)
 
     if request.method == 'POST':
         msg_text = request.form.get('message', '').strip()
@@ -734,21 +2760,121 @@ def session_chat(appt_id):
             new_msg = ChatMessage(appointment_id=appt.id, sender_id=user.id, message=msg_text)
             db.session.add(new_msg)
             db.session.commit()
+            # Push to everyone watching this appointment's stream
+            chat_broker.publish(appt.id, {
+                'id': new_msg.id,
+                'sender_id': new_msg.sender_id,
+                'message': new_msg.message,
+            })
         return redirect(url_for('session_chat', appt_id=appt.id))
 
-    chat_messages = ChatMessage.query.filter_by(appointment_id=appt.id).order_by(ChatMessage.timestamp.asc()).all()
-
     # --- THE MAGIC PART ---
-    # If the request has this header, return JUST the bubbles
+    # If the request has this header, return JUST the messages the client is missing
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        html = ""
-        for m in chat_messages:
-            side = "sent" if m.sender_id == user.id else "received"
-            html += f'<div class="msg {side}">{m.message}</div>'
-        return html
-
-    # Otherwise, return the whole page
-    return render_template('session_chat.html', appt=appt, chat_messages=chat_messages, current_user=user)
+        before_id = request.args.get('before_id', type=int)
+
+        # "Load older": one page of history ending just before the oldest bubble on screen
+        if before_id is not None:
+            older = ChatMessage.query.filter(
+                ChatMessage.appointment_id == appt.id,
+                ChatMessage.id < before_id
+            ).order_by(ChatMessage.id.desc()).limit(CHAT_PAGE_SIZE + 1).all()
+            has_more = len(older) > CHAT_PAGE_SIZE
+            older = list(reversed(older[:CHAT_PAGE_SIZE]))
+            return jsonify(
+                messages=[serialize_chat_message(m, user) for m in older],
+                has_more=has_more
+            )
+
+        # Polling: only messages after the client's cursor.
+        # The newest id doubles as the ETag, so an idle poll is one indexed MAX() and a 304.
+        since_id = request.args.get('since_id', 0, type=int)
+        latest_id = db.session.query(db.func.max(ChatMessage.id)) \
+            .filter(ChatMessage.appointment_id == appt.id).scalar() or 0
+        etag = f"chat-{appt.id}-{user.id}-{since_id}-{latest_id}"
+        if request.if_none_match.contains(etag):
+            return "", 304
+
+        new_messages = ChatMessage.query.filter(
+            ChatMessage.appointment_id == appt.id,
+            ChatMessage.id > since_id
+        ).order_by(ChatMessage.id.asc()).limit(CHAT_PAGE_SIZE).all()
+
+        response = jsonify(
+            messages=[serialize_chat_message(m, user) for m in new_messages],
+            last_id=new_messages[-1].id if new_messages else since_id
+        )
+        response.set_etag(etag)
+        return response
+
+    # Otherwise, return the whole page with only the most recent messages
+    recent = ChatMessage.query.filter_by(appointment_id=appt.id) \
+        .order_by(ChatMessage.id.desc()).limit(CHAT_PAGE_SIZE + 1).all()
+    has_older = len(recent) > CHAT_PAGE_SIZE
+    chat_messages = list(reversed(recent[:CHAT_PAGE_SIZE]))
+
+    return render_template('session_chat.html', appt=appt, chat_messages=chat_messages,
+                           current_user=user, has_older=has_older)
+
+@app.route('/chat/<int:appt_id>/stream')
+@login_required
+def session_chat_stream(appt_id):
+    user = g.user
+
+    appt = Appointment.query.get_or_404(appt_id)
+    if not is_chat_participant(appt, user):
+        return Response("Not your session", status=403)
+
+    # Subscribe before the replay query so nothing published in between is lost
+    q = chat_broker.subscribe(appt.id)
+    if q is None:
+        # Worker is at capacity: the page keeps polling with since_id instead
+        return Response("Too many open chat streams", status=503, headers={'Retry-After': '30'})
+
+    # EventSource sends Last-Event-ID on reconnect; the first connect passes last_id
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_id', 0, type=int)
+
+    try:
+        missed = [
+            {'id': m.id, 'sender_id': m.sender_id, 'message': m.message}
+            for m in ChatMessage.query.filter(
+                ChatMessage.appointment_id == appt.id,
+                ChatMessage.id > last_id
+            ).order_by(ChatMessage.id.asc()).all()
+        ]
+    except Exception:
+        chat_broker.unsubscribe(appt.id, q)
+        raise
+    user_id = user.id
+
+    def generate():
+        # No database access in here: an idle stream only waits on its queue
+        sent_id = last_id
+        try:
+            yield "retry: 3000\n\n"
+            for m in missed:
+                sent_id = m['id']
+                yield sse_event(m, user_id)
+
+            deadline = time.monotonic() + CHAT_STREAM_LIFETIME_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    m = q.get(timeout=CHAT_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                if m['id'] > sent_id:
+                    sent_id = m['id']
+                    yield sse_event(m, user_id)
+        finally:
+            chat_broker.unsubscribe(appt.id, q)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 @app.route('/toss-into-void', methods=['POST'])
 def toss_into_void():
     # We grab the thought but don't save it to any database
@@ -766,48 +2892,61 @@ def clear_void():
     _ = get_flashed_messages(category_filter=["void_success"])
     return redirect(url_for('home') + '#void')
 
+# --- Catalog Cache ---
+# The yoga/meditation listings are the same for every user, so they are cached
+# per filter combination; each user's progress is overlaid after the lookup.
+CATALOG_CACHE_SIZE = 256
+CATALOG_CACHE_TTL_SECONDS = 600  # backstop only: the write routes invalidate
+
+catalog_cache = VersionedCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL_SECONDS, namespace='catalog')
+
+def column_dicts(rows):
+    # Plain values, so cached rows outlive the session that loaded them
+    return [{c.key: getattr(row, c.key) for c in db.inspect(row).mapper.column_attrs} for row in rows]
+
+@app.route('/catalog/cache-stats/')
+def catalog_cache_stats():
+    return jsonify(catalog_cache.snapshot())
+
 @app.route('/yoga/')
+@login_required
+@read_replica
 def yoga_page():
-    if 'username' not in session:
-        return redirect(url_for('login'))
-    
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     
     # Get filter parameters
     difficulty_filter = request.args.get('difficulty', 'all')
     category_filter = request.args.get('category', 'all')
     
-    # Build query
-    query = YogaPose.query
-    
-    if difficulty_filter != 'all':
-        query = query.filter_by(difficulty=difficulty_filter)
-    if category_filter != 'all':
-        query = query.filter_by(category=category_filter)
-    
-    poses = query.order_by(YogaPose.created_at.desc()).all()
-    
-    # Get user's completed yoga sessions
-    user_progress = UserProgress.query.filter_by(
-        user_id=user.id,
-        activity_type='yoga'
-    ).all()
+    def load_poses():
+        query = YogaPose.query
+        
+        if difficulty_filter != 'all':
+            query = query.filter_by(difficulty=difficulty_filter)
+        if category_filter != 'all':
+            query = query.filter_by(category=category_filter)
+        
+        return column_dicts(query.order_by(YogaPose.created_at.desc()).all())
+
+    poses = catalog_cache.listing('yoga', (difficulty_filter, category_filter), load_poses)
     
-    completed_ids = [p.activity_id for p in user_progress]
+    # Get user's completed yoga sessions (one rollup row)
+    rollup = get_rollup(user.id, 'yoga')
+    completed_ids = set(rollup.completed_id_list())
     
     return render_template('yoga.html', 
                          user=user, 
                          poses=poses, 
                          completed_ids=completed_ids,
+                         current_streak=rollup.streak_as_of(date.today()),
+                         longest_streak=rollup.longest_streak,
                          difficulty_filter=difficulty_filter,
                          category_filter=category_filter)
 
 @app.route('/yoga/add', methods=['GET', 'POST'])
+@login_required
 def add_yoga_pose():
-    if 'username' not in session:
-        return redirect(url_for('login'))
-    
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     
     if request.method == 'POST':
         name = request.form.get('name')
@@ -818,21 +2957,18 @@ def add_yoga_pose():
         precautions = request.form.get('precautions')
         video_file = request.files.get('video')
         video_filename = None
-
-        if video_file and video_file.filename:
-            video_filename = f"yoga_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{video_file.filename}"
-            video_folder = os.path.join(app.static_folder, 'yoga_videos')
-            os.makedirs(video_folder, exist_ok=True)
-            video_file.save(os.path.join(video_folder, video_filename))
         # Handle image upload
         image_file = request.files.get('image')
         image_filename = None
-        
-        if image_file and image_file.filename:
-            image_filename = f"yoga_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{image_file.filename}"
-            img_folder = os.path.join(app.static_folder, 'yoga_images')
-            os.makedirs(img_folder, exist_ok=True)
-            image_file.save(os.path.join(img_folder, image_filename))
+
+        try:
+            if video_file and video_file.filename:
+                video_filename = store_upload(video_file, 'video')
+            if image_file and image_file.filename:
+                image_filename = store_upload(image_file, 'image')
+        except UploadRejected as e:
+            flash(str(e), 'danger')
+            return render_template('add_yoga.html', user=user)
         
         new_pose = YogaPose(
             name=name,
@@ -847,6 +2983,7 @@ def add_yoga_pose():
         )
         
         db.session.add(new_pose)
+        catalog_cache.invalidate_kind('yoga')
         db.session.commit()
         flash('Yoga pose added successfully!', 'success')
         return redirect(url_for('yoga_page'))
@@ -854,11 +2991,9 @@ def add_yoga_pose():
     return render_template('add_yoga.html', user=user)
 
 @app.route('/yoga/<int:pose_id>')
+@login_required
 def yoga_detail(pose_id):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-    
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     pose = YogaPose.query.get_or_404(pose_id)
     
     # Check if user completed this pose
@@ -871,11 +3006,9 @@ def yoga_detail(pose_id):
     return render_template('yoga_detail.html', user=user, pose=pose, progress=progress)
 
 @app.route('/yoga/<int:pose_id>/complete', methods=['POST'])
+@login_required
 def complete_yoga(pose_id):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-    
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     duration = request.form.get('duration', 0)
     notes = request.form.get('notes', '')
     
@@ -884,63 +3017,61 @@ def complete_yoga(pose_id):
         activity_type='yoga',
         activity_id=pose_id,
         duration_completed=int(duration),
-        notes=notes
+        notes=notes,
+        completed_at=datetime.now()
     )
     
     db.session.add(progress)
+    record_activity(db.session, user.id, 'yoga', pose_id, progress.duration_completed,
+                    progress.completed_at.date())
     db.session.commit()
     flash('Great job! Yoga session completed!', 'success')
     return redirect(url_for('yoga_page'))
 
 @app.route('/meditation/')
+@login_required
+@read_replica
 def meditation_page():
-    if 'username' not in session:
-        return redirect(url_for('login'))
-    
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     
     # Get filter parameters
     type_filter = request.args.get('type', 'all')
     duration_filter = request.args.get('duration', 'all')
     
-    # Build query
-    query = MeditationSession.query
-    
-    if type_filter != 'all':
-        query = query.filter_by(type=type_filter)
-    if duration_filter != 'all':
-        if duration_filter == 'short':
-            query = query.filter(MeditationSession.duration <= 10)
-        elif duration_filter == 'medium':
-            query = query.filter(MeditationSession.duration > 10, MeditationSession.duration <= 20)
-        else:  # long
-            query = query.filter(MeditationSession.duration > 20)
-    
-    sessions = query.order_by(MeditationSession.created_at.desc()).all()
-    
-    # Get user's meditation stats
-    user_progress = UserProgress.query.filter_by(
-        user_id=user.id,
-        activity_type='meditation'
-    ).all()
+    def load_sessions():
+        query = MeditationSession.query
+        
+        if type_filter != 'all':
+            query = query.filter_by(type=type_filter)
+        if duration_filter != 'all':
+            if duration_filter == 'short':
+                query = query.filter(MeditationSession.duration <= 10)
+            elif duration_filter == 'medium':
+                query = query.filter(MeditationSession.duration > 10, MeditationSession.duration <= 20)
+            else:  # long
+                query = query.filter(MeditationSession.duration > 20)
+        
+        return column_dicts(query.order_by(MeditationSession.created_at.desc()).all())
+
+    sessions = catalog_cache.listing('meditation', (type_filter, duration_filter), load_sessions)
     
-    total_minutes = sum(p.duration_completed for p in user_progress)
-    total_sessions = len(user_progress)
+    # Get user's meditation stats (one rollup row)
+    rollup = get_rollup(user.id, 'meditation')
     
     return render_template('meditation.html', 
                          user=user, 
                          sessions=sessions,
-                         total_minutes=total_minutes,
-                         total_sessions=total_sessions,
+                         total_minutes=rollup.total_minutes,
+                         total_sessions=rollup.total_sessions,
+                         current_streak=rollup.streak_as_of(date.today()),
+                         longest_streak=rollup.longest_streak,
                          type_filter=type_filter,
                          duration_filter=duration_filter)
 
 @app.route('/meditation/add', methods=['GET', 'POST'])
+@login_required
 def add_meditation():
-    if 'username' not in session:
-        return redirect(url_for('login'))
-    
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     
     if request.method == 'POST':
         title = request.form.get('title')
@@ -961,6 +3092,7 @@ def add_meditation():
         )
         
         db.session.add(new_session)
+        catalog_cache.invalidate_kind('meditation')
         db.session.commit()
         flash('Meditation session added successfully!', 'success')
         return redirect(url_for('meditation_page'))
@@ -968,21 +3100,17 @@ def add_meditation():
     return render_template('add_meditation.html', user=user)
 
 @app.route('/meditation/<int:session_id>')
+@login_required
 def meditation_detail(session_id):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-    
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     session_data = MeditationSession.query.get_or_404(session_id)
     
     return render_template('meditation_detail.html', user=user, session=session_data)
 
 @app.route('/meditation/<int:session_id>/complete', methods=['POST'])
+@login_required
 def complete_meditation(session_id):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-    
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     duration = request.form.get('duration', 0)
     notes = request.form.get('notes', '')
     
@@ -991,20 +3119,21 @@ def complete_meditation(session_id):
         activity_type='meditation',
         activity_id=session_id,
         duration_completed=int(duration),
-        notes=notes
+        notes=notes,
+        completed_at=datetime.now()
     )
     
     db.session.add(progress)
+    record_activity(db.session, user.id, 'meditation', session_id, progress.duration_completed,
+                    progress.completed_at.date())
     db.session.commit()
     flash('Wonderful! Meditation session completed!', 'success')
     return redirect(url_for('meditation_page'))
 
 @app.route('/meditation/<int:session_id>/delete', methods=['POST'])
+@login_required
 def delete_meditation(session_id):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     session_data = MeditationSession.query.get_or_404(session_id)
 
     # Only allow creator to delete
@@ -1012,38 +3141,622 @@ def delete_meditation(session_id):
         flash("You are not authorized to delete this session.", "danger")
         return redirect(url_for('meditation_page'))
 
-    # Delete related progress first (optional but safer)
-    UserProgress.query.filter_by(
-        activity_type='meditation',
-        activity_id=session_id
-    ).delete()
+    # Delete related progress first (optional but safer), then fix up those users' rollups
+    delete_progress_for('meditation', session_id)
 
     db.session.delete(session_data)
+    catalog_cache.invalidate_kind('meditation')
     db.session.commit()
 
     flash("Meditation session deleted successfully.", "success")
     return redirect(url_for('meditation_page'))
 
 @app.route('/yoga/<int:pose_id>/delete', methods=['POST'])
+@login_required
 def delete_yoga(pose_id):
-    if 'username' not in session:
-        return redirect(url_for('login'))
-
     pose = YogaPose.query.get_or_404(pose_id)
 
     # Optional: Only creator can delete
-    user = User.query.filter_by(username=session['username']).first()
+    user = g.user
     if pose.created_by != user.id:
         flash("You cannot delete this pose.", "danger")
         return redirect(url_for('yoga_page'))
 
+    # Same as meditation: its progress goes with it, and the rollups follow
+    delete_progress_for('yoga', pose_id)
     db.session.delete(pose)
+    catalog_cache.invalidate_kind('yoga')
     db.session.commit()
 
     flash("Yoga pose deleted successfully!", "success")
     return redirect(url_for('yoga_page'))
 
 
+# --- Activity Rollups ---
+def record_activity(sess, user_id, activity_type, activity_id, minutes, day):
+    """Fold one completed session into the user's rollup. The caller commits."""
+    # Insert first: the write lock it takes means no other request can change
+    # this row between the read below and our commit.
+    sess.execute(sqlite_insert(ActivityRollup).values(
+        user_id=user_id, activity_type=activity_type, total_sessions=0, total_minutes=0,
+        completed_ids='[]', current_streak=0, longest_streak=0
+    ).on_conflict_do_nothing())
+    rollup = sess.query(ActivityRollup).populate_existing() \
+        .filter_by(user_id=user_id, activity_type=activity_type).one()
+
+    rollup.total_sessions += 1
+    rollup.total_minutes += minutes
+    ids = rollup.completed_id_list()
+    if activity_id not in ids:
+        rollup.completed_ids = json.dumps(sorted(ids + [activity_id]))
+
+    last = rollup.last_active_on
+    if last is None or day > last:
+        rollup.current_streak = rollup.current_streak + 1 if last == day - timedelta(days=1) else 1
+        rollup.longest_streak = max(rollup.longest_streak, rollup.current_streak)
+        rollup.last_active_on = day
+    return rollup
+
+def get_rollup(user_id, activity_type):
+    return ActivityRollup.query.get((user_id, activity_type)) or ActivityRollup(
+        user_id=user_id, activity_type=activity_type, total_sessions=0, total_minutes=0,
+        completed_ids='[]', current_streak=0, longest_streak=0
+    )
+
+def streaks(days):
+    """(current, longest) run of consecutive days in an ascending list of distinct dates."""
+    current = longest = 0
+    previous = None
+    for day in days:
+        current = current + 1 if previous == day - timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest
+
+def rebuild_rollups(user_ids=None):
+    """Recompute rollups from UserProgress in bulk, for everyone or just user_ids."""
+    progress = UserProgress.query
+    rollups = ActivityRollup.query
+    if user_ids is not None:
+        progress = progress.filter(UserProgress.user_id.in_(user_ids))
+        rollups = rollups.filter(ActivityRollup.user_id.in_(user_ids))
+    rollups.delete(synchronize_session=False)
+
+    key = (UserProgress.user_id, UserProgress.activity_type)
+    totals = progress.with_entities(
+        *key, db.func.count(UserProgress.id), db.func.coalesce(db.func.sum(UserProgress.duration_completed), 0)
+    ).group_by(*key).all()
+    ids, days = {}, {}
+    for user_id, activity_type, activity_id in progress.with_entities(*key, UserProgress.activity_id) \
+            .distinct().order_by(UserProgress.activity_id):
+        ids.setdefault((user_id, activity_type), []).append(activity_id)
+    day_column = db.func.date(UserProgress.completed_at)
+    for user_id, activity_type, day in progress.with_entities(*key, day_column) \
+            .filter(UserProgress.completed_at.isnot(None)).distinct().order_by(day_column):
+        days.setdefault((user_id, activity_type), []).append(date.fromisoformat(day))
+
+    rows = []
+    for user_id, activity_type, sessions, minutes in totals:
+        active_days = days.get((user_id, activity_type), [])
+        current, longest = streaks(active_days)
+        rows.append(dict(
+            user_id=user_id, activity_type=activity_type,
+            total_sessions=sessions, total_minutes=minutes,
+            completed_ids=json.dumps(ids.get((user_id, activity_type), [])),
+            current_streak=current, longest_streak=longest,
+            last_active_on=active_days[-1] if active_days else None
+        ))
+    if rows:
+        db.session.execute(db.insert(ActivityRollup), rows)
+    return len(rows)
+
+def delete_progress_for(activity_type, activity_id):
+    """Drop an activity's progress rows and re-derive the affected users' rollups. The caller commits."""
+    progress = UserProgress.query.filter_by(activity_type=activity_type, activity_id=activity_id)
+    user_ids = [row[0] for row in progress.with_entities(UserProgress.user_id).distinct()]
+    progress.delete(synchronize_session=False)
+    if user_ids:
+        rebuild_rollups(user_ids)
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recompute every user's yoga/meditation rollup from UserProgress."""
+    count = rebuild_rollups()
+    db.session.commit()
+    print(f"Rebuilt {count} activity rollups.")
+
+
+# --- Query Plan Check ---
+# Representative versions of the hot route queries. `flask --app serenify.py check-indexes`
+# runs EXPLAIN QUERY PLAN on each and exits non-zero if any falls back to a full table scan.
+def hot_queries():
+    now = datetime.now()
+    today = date.today()
+    return [
+        ("home / past_entries", DiaryEntry.query.filter(
+            DiaryEntry.user_id == 1
+        ).order_by(DiaryEntry.created_at.desc()).limit(7)),
+        ("past_entries date search", DiaryEntry.query.filter(
+            DiaryEntry.user_id == 1,
+            DiaryEntry.created_at >= now,
+            DiaryEntry.created_at < now + timedelta(days=1)
+        ).order_by(DiaryEntry.created_at.desc())),
+        ("distress_page", Comment.query.filter(
+            Comment.topic == "study",
+            Comment.parent_id.is_(None)
+        ).order_by(Comment.created_at.desc(), Comment.id.desc()).limit(COMMENTS_PAGE_SIZE + 1)),
+        ("comment replies", Comment.query.filter(Comment.parent_id.in_([1, 2, 3]))),
+        ("booking day counter", AppointmentDayCount.query.filter_by(
+            professional_id=1, date=today
+        )),
+        ("booking active slot", Appointment.query.filter(
+            Appointment.professional_id == 1,
+            Appointment.date == today,
+            Appointment.time_slot == TIME_SLOTS[0],
+            Appointment.status.in_(ACTIVE_STATUSES)
+        )),
+        ("professional_dashboard", Appointment.query.filter(
+            Appointment.professional_id == 1,
+            Appointment.date >= today
+        ).order_by(Appointment.date.asc(), Appointment.time_slot.asc())),
+        ("professional_support", Appointment.query.filter_by(user_id=1)),
+        ("availability calendar", db.session.query(
+            Appointment.date, Appointment.time_slot, db.func.count(Appointment.id)
+        ).filter(
+            Appointment.professional_id == 1,
+            Appointment.date >= today,
+            Appointment.date < today + timedelta(days=AVAILABILITY_DAYS),
+            Appointment.status.in_(["pending", "accepted"])
+        ).group_by(Appointment.date, Appointment.time_slot)),
+        ("session_chat poll", ChatMessage.query.filter(
+            ChatMessage.appointment_id == 1,
+            ChatMessage.id > 0
+        ).order_by(ChatMessage.id.asc())),
+        ("session_chat latest id", db.session.query(db.func.max(ChatMessage.id))
+            .filter(ChatMessage.appointment_id == 1)),
+        ("yoga/meditation progress", UserProgress.query.filter_by(
+            user_id=1, activity_type="yoga"
+        )),
+        ("yoga_detail progress", UserProgress.query.filter_by(
+            user_id=1, activity_type="yoga", activity_id=1
+        )),
+    ]
+
+def explain_query_plan(query):
+    compiled = query.statement.compile(dialect=db.engine.dialect,
+                                       compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).all()
+    return [row[-1] for row in rows]
+
+def is_full_scan(detail):
+    # "SCAN diary_entry" is a table scan; "SCAN x USING INDEX" / "SEARCH ..." are fine
+    return detail.startswith("SCAN ") and "USING" not in detail
+
+@app.cli.command("check-indexes")
+def check_indexes():
+    """Fail if any hot query path does a full table scan."""
+    failed = False
+    for name, query in hot_queries():
+        plan = explain_query_plan(query)
+        scans = [d for d in plan if is_full_scan(d)]
+        print(f"{'FAIL' if scans else 'ok  '} {name}: {' | '.join(plan)}")
+        failed = failed or bool(scans)
+    if failed:
+        raise SystemExit(1)
+
+
+# --- Booking Stress Check ---
+@app.cli.command("stress-booking")
+@click.option("--threads", default=16, help="Concurrent booking threads.")
+@click.option("--attempts", default=25, help="Bookings each thread tries.")
+def stress_booking(threads, attempts):
+    """Hammer book_appointment() from many threads on a scratch database and
+    fail if any slot or day ends up overbooked."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'stress.db')}",
+                               connect_args={"timeout": 60})
+        db.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as sess:
+            user = User(name="stress", username="stress", email="stress@example.com", password_hash="-")
+            sess.add(user)
+            sess.flush()
+            professional = Professional(user_id=user.id, full_name="Stress Test")
+            sess.add(professional)
+            sess.commit()
+            user_id, professional_id = user.id, professional.id
+
+        days = [date.today() + timedelta(days=i) for i in range(2)]
+        outcomes = {"booked": 0, "rejected": 0}
+        outcomes_lock = threading.Lock()
+        start = threading.Barrier(threads)
+
+        def worker(n):
+            rng = random.Random(n)
+            start.wait()
+            for _ in range(attempts):
+                with Session() as sess:
+                    appt, _ = book_appointment(
+                        sess, user_id=user_id, professional_id=professional_id,
+                        date=rng.choice(days), time_slot=rng.choice(TIME_SLOTS),
+                        full_name="stress", mobile="0000000000"
+                    )
+                with outcomes_lock:
+                    outcomes["booked" if appt else "rejected"] += 1
+
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+
+        with Session() as sess:
+            per_slot = sess.query(Appointment.date, Appointment.time_slot, db.func.count()) \
+                .group_by(Appointment.date, Appointment.time_slot).all()
+            per_day = dict(sess.query(Appointment.date, db.func.count()).group_by(Appointment.date).all())
+            counters = {c.date: c.booked for c in sess.query(AppointmentDayCount).all()}
+        engine.dispose()
+
+    problems = [f"{d} {slot}: {n} bookings" for d, slot, n in per_slot if n > 1]
+    problems += [f"{d}: {n} bookings" for d, n in per_day.items() if n > MAX_APPOINTMENTS_PER_DAY]
+    problems += [f"{d}: counter {counters.get(d)} != {n}" for d, n in per_day.items() if counters.get(d) != n]
+    print(f"{outcomes['booked']} booked, {outcomes['rejected']} rejected "
+          f"across {threads} threads x {attempts} attempts")
+    for p in problems:
+        print("OVERBOOKED", p)
+    if problems:
+        raise SystemExit(1)
+
+
+# --- Benchmarks ---
+# `flask --app serenify.py bench seed` fills the configured database with synthetic
+# data (point DATABASE_URL at a scratch file first); `bench load` drives the main
+# routes and writes latency/throughput/query counts as JSON for comparing commits.
+@app.cli.group()
+def bench():
+    """Synthetic data and load benchmarks."""
+
+BENCH_WORDS = (
+    "today felt heavy light tired calm anxious exam sleep family work friend walk "
+    "run coffee rain sun class deadline mum dad sister brother therapy breathe "
+    "journal grateful lonely hopeful stressed meeting lecture dinner music gym "
+    "morning night weekend call message budget rent money health headache"
+).split()
+BENCH_TOPICS = ["study", "family", "chronic", "financial", "existential", "overwhelm"]
+BENCH_PROMPTS = [
+    "I feel anxious about my exams", "I can't sleep", "How do I calm down?",
+    "I'm stressed about money", "I feel lonely", "Tips for a panic attack?",
+    "I had a fight with my family", "I'm overwhelmed at work", "How do I start journaling?",
+    "What is a breathing exercise I can do?",
+]
+
+def bench_text(rng, words):
+    return " ".join(rng.choice(BENCH_WORDS) for _ in range(words))
+
+def next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+def insert_batches(model, rows, batch_size, label):
+    """executemany in batches of batch_size rows, one commit per batch."""
+    batch, total = [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(db.insert(model), batch)
+            db.session.commit()
+            total += len(batch)
+            batch = []
+            click.echo(f"\r  {label}: {total}", nl=False)
+    if batch:
+        db.session.execute(db.insert(model), batch)
+        db.session.commit()
+        total += len(batch)
+    click.echo(f"\r  {label}: {total}")
+    return total
+
+@bench.command("seed")
+@click.option("--users", default=100_000, help="Users to create.")
+@click.option("--entries-per-user", default=100, help="Diary entries per user (100k x 100 = 10M).")
+@click.option("--professionals", default=1_000, help="Users who are also professionals.")
+@click.option("--comments-per-topic", default=20_000, help="Comments on each distress topic.")
+@click.option("--appointments", default=5_000, help="Accepted appointments.")
+@click.option("--messages", default=50_000, help="Chat messages across those appointments.")
+@click.option("--batch-size", default=10_000, help="Rows per INSERT batch.")
+@click.option("--seed", default=42, help="Random seed, so runs are comparable.")
+@click.option("--yes", is_flag=True, help="Don't ask before writing to the database.")
+def bench_seed(users, entries_per_user, professionals, comments_per_topic, appointments,
+               messages, batch_size, seed, yes):
+    """Bulk-insert a realistic synthetic dataset. Every bench user's password is 'bench'."""
+    if not yes:
+        click.confirm(f"Add synthetic data to {db.engine.url}?", abort=True)
+    rng = random.Random(seed)
+    db.create_all()
+    now = datetime.now()
+    password_hash = hash_password("bench")
+    professionals = min(professionals, users)
+
+    first_user = next_id(User)
+    user_ids = range(first_user, first_user + users)
+    insert_batches(User, ({
+        'id': uid, 'name': f"Bench User {uid}", 'username': f"bench{uid}", 'email': f"bench{uid}@example.com",
+        'password_hash': password_hash, 'role': 'professional' if uid - first_user < professionals else 'user',
+    } for uid in user_ids), batch_size, "users")
+
+    first_pro = next_id(Professional)
+    pro_ids = range(first_pro, first_pro + professionals)
+    insert_batches(Professional, ({
+        'id': pid, 'user_id': first_user + (pid - first_pro), 'full_name': f"Dr Bench {pid}",
+        'profession': rng.choice(["Therapist", "Counselor", "Psychologist"]),
+        'bio': bench_text(rng, 30), 'experience': rng.randint(1, 30), 'verified': False,
+    } for pid in pro_ids), batch_size, "professionals")
+
+    def diary_rows():
+        for uid in user_ids:
+            for _ in range(entries_per_user):
+                content = bench_text(rng, rng.randint(20, 120))
+                yield {
+                    'user_id': uid, 'content': content, 'emoji': rng.choice(EMOJIS),
+                    'snippet': content[:DIARY_SNIPPET_LENGTH] + ("…" if len(content) > DIARY_SNIPPET_LENGTH else ""),
+                    'created_at': now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+                }
+    insert_batches(DiaryEntry, diary_rows(), batch_size, "diary entries")
+
+    def comment_rows():
+        comment_id = next_id(Comment)
+        for topic in BENCH_TOPICS:
+            top_level = []
+            for _ in range(comments_per_topic):
+                parent = rng.choice(top_level) if top_level and rng.random() < 0.3 else None
+                if parent is None:
+                    top_level.append(comment_id)
+                yield {
+                    'id': comment_id, 'topic': topic, 'text': bench_text(rng, rng.randint(5, 40)),
+                    'user_id': rng.choice(user_ids), 'parent_id': parent,
+                    'created_at': now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600)),
+                }
+                comment_id += 1
+    insert_batches(Comment, comment_rows(), batch_size, "comments")
+
+    # Distinct (professional, day, slot) so the active-slot index holds
+    first_appt = next_id(Appointment)
+    today = date.today()
+    appts, day_counts = [], {}
+    for k in range(appointments):
+        pid = pro_ids[k % professionals]
+        slot_number = k // professionals
+        day = today + timedelta(days=slot_number // len(TIME_SLOTS) + 1)
+        appts.append({
+            'id': first_appt + k, 'user_id': rng.choice(user_ids[professionals:] or user_ids),
+            'professional_id': pid, 'full_name': "Bench Client", 'mobile': "0000000000",
+            'date': day, 'time_slot': TIME_SLOTS[slot_number % len(TIME_SLOTS)],
+            'notes': bench_text(rng, 10), 'status': "accepted",
+        })
+        day_counts[(pid, day)] = day_counts.get((pid, day), 0) + 1
+    insert_batches(Appointment, appts, batch_size, "appointments")
+    if day_counts:
+        stmt = sqlite_insert(AppointmentDayCount)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[AppointmentDayCount.professional_id, AppointmentDayCount.date],
+            set_=dict(booked=AppointmentDayCount.booked + stmt.excluded.booked)
+        ), [{'professional_id': pid, 'date': day, 'booked': n} for (pid, day), n in day_counts.items()])
+        db.session.commit()
+
+    def message_rows():
+        for _ in range(messages if appts else 0):
+            appt = rng.choice(appts)
+            sender = appt['user_id'] if rng.random() < 0.5 else first_user + (appt['professional_id'] - first_pro)
+            yield {
+                'appointment_id': appt['id'], 'sender_id': sender, 'message': bench_text(rng, rng.randint(3, 25)),
+                'timestamp': now - timedelta(seconds=rng.randint(0, 7 * 24 * 3600)),
+            }
+    insert_batches(ChatMessage, message_rows(), batch_size, "chat messages")
+
+    click.echo("Rebuilding mood rollups...")
+    rebuild_mood_days(list(user_ids))
+    db.session.commit()
+    click.echo("Done.")
+
+class StubModel:
+    """Stands in for Gemini during `bench load`: fixed latency, no network."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, contents, stream=False):
+        # Same conversion the real client does first, so malformed history fails here too
+        content_types.to_contents(contents)
+        reply = namedtuple('Reply', 'text')
+        if stream:
+            def chunks():
+                for word in ["Take", " a", " slow", " breath."]:
+                    time.sleep(self.latency / 4)
+                    yield reply(word)
+            return chunks()
+        time.sleep(self.latency)
+        return reply("Take a slow breath. You're doing fine.")
+
+def percentile(sorted_values, p):
+    # Nearest-rank
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+@bench.command("load")
+@click.option("--duration", default=10.0, help="Seconds to run.")
+@click.option("--concurrency", default=8, help="Concurrent simulated users.")
+@click.option("--route", "routes", multiple=True,
+              help="Only these routes (home, past_entries, distress, chat_poll, appointment, chatbot).")
+@click.option("--model-latency", default=0.2, help="Seconds the stub chatbot model takes per reply.")
+@click.option("--output", default=None, help="JSON results file (default: bench-<commit>-<time>.json).")
+@click.option("--seed", default=42, help="Random seed.")
+def bench_load(duration, concurrency, routes, model_latency, output, seed):
+    """Drive concurrent in-process requests at the key routes and record p50/p95/p99,
+    throughput and SQL queries per request."""
+    global model
+    rng = random.Random(seed)
+    user_ids = [uid for (uid,) in db.session.query(User.id).filter(User.role == 'user')
+                .order_by(db.func.random()).limit(1000)]
+    pro_ids = [pid for (pid,) in db.session.query(Professional.id).limit(1000)]
+    # Chat pages only answer the appointment's participants, so pollers poll their own
+    appts_by_user = {}
+    for aid, uid in db.session.query(Appointment.id, Appointment.user_id).limit(5000):
+        appts_by_user.setdefault(uid, []).append(aid)
+    if not user_ids:
+        raise click.ClickException("No users to log in as; run `flask bench seed` first.")
+
+    worker = threading.local()
+    def chat_poll(client, rng):
+        appt_id = rng.choice(worker.appt_ids)
+        return client.get(f"/chat/{appt_id}/?since_id={rng.randint(0, 1000)}",
+                          headers={'X-Requested-With': 'XMLHttpRequest'})
+
+    scenarios = {
+        'home': lambda client, rng: client.get("/"),
+        'past_entries': lambda client, rng: client.get("/past-entries/"),
+        'distress': lambda client, rng: client.get(f"/distress/{rng.choice(BENCH_TOPICS)}/"),
+        'chat_poll': chat_poll if appts_by_user else None,
+        'appointment': (lambda client, rng: client.get(f"/appointment/{rng.choice(pro_ids)}")) if pro_ids else None,
+        'chatbot': lambda client, rng: client.post("/chatbot/", data={'message': rng.choice(BENCH_PROMPTS)}),
+    }
+    selected = [name for name in (routes or scenarios) if scenarios.get(name)]
+    if not selected:
+        raise click.ClickException(f"No runnable routes among: {', '.join(routes)}")
+
+    counter = threading.local()
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter.queries = getattr(counter, 'queries', 0) + 1
+
+    samples = {name: [] for name in selected}  # (seconds, queries, ok)
+    samples_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def simulated_user(worker_seed):
+        worker_rng = random.Random(worker_seed)
+        # Left before the requests start, so each request gets its own context and session
+        with app.app_context():
+            # With chat_poll in the mix every simulated user is someone who has booked
+            pool = sorted(appts_by_user) if 'chat_poll' in selected else user_ids
+            user = User.query.get(worker_rng.choice(pool))
+            username, user_id = user.username, user.id
+        worker.appt_ids = appts_by_user.get(user_id, [])
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['username'], sess['user_id'] = username, user_id
+        local = []
+        while time.monotonic() < deadline:
+            name = worker_rng.choice(selected)
+            counter.queries = 0
+            start = time.perf_counter()
+            response = scenarios[name](client, worker_rng)
+            elapsed = time.perf_counter() - start
+            local.append((name, elapsed, counter.queries, response.status_code < 400))
+        with samples_lock:
+            for name, elapsed, queries, ok in local:
+                samples[name].append((elapsed, queries, ok))
+
+    real_model = model
+    model = StubModel(model_latency)
+    event.listen(Engine, "before_cursor_execute", count_query)
+    try:
+        threads = [threading.Thread(target=simulated_user, args=(rng.randrange(2**32),))
+                   for _ in range(concurrency)]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.monotonic() - started
+    finally:
+        event.remove(Engine, "before_cursor_execute", count_query)
+        model = real_model
+
+    results = {}
+    for name, rows in samples.items():
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in rows)
+        results[name] = {
+            'requests': len(rows),
+            'errors': sum(1 for _, _, ok in rows if not ok),
+            'throughput_rps': round(len(rows) / wall, 1),
+            'p50_ms': round(percentile(latencies, 50), 2) if rows else None,
+            'p95_ms': round(percentile(latencies, 95), 2) if rows else None,
+            'p99_ms': round(percentile(latencies, 99), 2) if rows else None,
+            'queries_per_request': round(sum(q for _, q, _ in rows) / len(rows), 2) if rows else None,
+        }
+        click.echo(f"{name:<14} {results[name]['requests']:>7} req  {results[name]['throughput_rps']:>8} req/s  "
+                   f"p50 {results[name]['p50_ms']} ms  p95 {results[name]['p95_ms']} ms  "
+                   f"p99 {results[name]['p99_ms']} ms  {results[name]['queries_per_request']} q/req")
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=app.root_path).stdout.strip() or None
+    except OSError:
+        commit = None
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    output = output or f"bench-{commit or 'nogit'}-{stamp}.json"
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'started_at': stamp,
+            'database': db.engine.url.render_as_string(hide_password=True),
+            'duration_seconds': round(wall, 2),
+            'concurrency': concurrency,
+            'model_latency_seconds': model_latency,
+            'routes': results,
+        }, f, indent=2)
+    click.echo(f"Saved {output}")
+
+@bench.command("logins")
+@click.option("--seconds", default=5.0, help="How long to run.")
+@click.option("--threads", default=0, help="Concurrent callers (default: 2 per pool worker).")
+def bench_logins(seconds, threads):
+    """Measure password verifications per second through the password pool."""
+    password_hash = hash_password("benchmark-password")
+    threads = threads or PASSWORD_WORKERS * 2
+    done = [0] * threads
+    busy = [0]
+    deadline = time.monotonic() + seconds
+
+    def caller(i):
+        while time.monotonic() < deadline:
+            try:
+                verify_password(password_hash, "benchmark-password")
+                done[i] += 1
+            except PasswordBusy:
+                busy[0] += 1
+
+    workers = [threading.Thread(target=caller, args=(i,)) for i in range(threads)]
+    start = time.monotonic()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    total = sum(done)
+    print(f"{total} logins in {elapsed:.1f}s with {threads} callers on {PASSWORD_WORKERS} workers")
+    print(f"{total / elapsed:.1f} logins/s, {total / elapsed / PASSWORD_WORKERS:.1f} logins/s per core"
+          f" ({PASSWORD_METHOD}); {busy[0]} turned away")
+
+
+# --- Local Replica ---
+@app.cli.command("sync-replica")
+def sync_replica():
+    """Copy the primary into the READ_REPLICA_URL SQLite file, for trying replica routing locally."""
+    import sqlite3
+    if 'replica' not in db.engines:
+        raise click.ClickException("Set READ_REPLICA_URL first, e.g. sqlite:///replica.db")
+    primary = db.engines[None].url.database
+    replica = db.engines['replica'].url.database
+    with sqlite3.connect(primary) as src, sqlite3.connect(replica) as dst:
+        src.backup(dst)
+    print(f"Copied {primary} -> {replica}")
+
+
 # --- Run App ---
 if __name__ == '__main__':
     app.run(debug=True)